@@ -1,7 +1,6 @@
 # coding=utf-8
 import os
 import sys
-import time
 import random
 import logging
 import datetime
@@ -28,7 +27,7 @@ class GhostKikka(Ghost):
 
     def __init__(self, gid, ghost_data, ghost_loader):
         Ghost.__init__(self, gid, ghost_data, ghost_loader)
-        self._datetime = datetime.datetime.now()
+        self._datetime = kikka.clock.wall_time()
         self._touch_count = {KIKKA: {}, TOWA: {}}
 
     def init(self):
@@ -215,8 +214,8 @@ class GhostKikka(Ghost):
     # ########################################################################################################
 
     def on_first_boot(self):
-        boot_last = datetime.datetime.fromtimestamp(self.memory_read('BootLast', time.time()))
-        today = datetime.datetime.now()
+        boot_last = datetime.datetime.fromtimestamp(self.memory_read('BootLast', kikka.clock.wall_time().timestamp()))
+        today = kikka.clock.wall_time()
         if boot_last.day == today.day:
             return
         self.daily_shell()
@@ -225,42 +224,8 @@ class GhostKikka(Ghost):
         self.talk(self.say_hello())
 
     def daily_shell(self):
-        today = datetime.datetime.now()
-        shell_name = None
-        # feastival
-        if today.month == 1 and today.day == 1:
-            shell_name = 'normal-Yukata'
-        elif today.month == 2 and today.day == 22:
-            shell_name = 'normal-NekoMimi'
-        elif today.month == 3 and today.day == 5:
-            shell_name = 'cosplay-SilverFox'
-        elif today.month == 3 and today.day == 9:
-            shell_name = 'cosplay-HatsuneMiku'
-        elif today.month == 3 and today.day == 28 \
-                or today.month == 4 and today.day == 29:
-            shell_name = 'cosplay-Momohime'
-        elif today.month == 4 and today.day == 8:
-            shell_name = 'cosplay-KonpakuYoumu'
-        elif today.month == 5 and today.day == 2:
-            shell_name = 'normal-Maid'
-        elif today.month == 6 and today.day == 10 \
-                or today.month == 8 and today.day == 11 \
-                or today.month == 7 and today.day == 27:
-            shell_name = 'cosplay-IzayoiSakuya'
-        elif today.month == 8 and today.day == 17:
-            shell_name = 'cosplay-InubashiriMomizi'
-        elif today.month == 9 and today.day == 3:
-            shell_name = 'cosplay-SetsukoOhara'
-        elif today.month == 10 and today.day == 13:
-            shell_name = 'private-Nurse'
-        elif today.month == 10 and today.day == 22:
-            shell_name = 'cosplay-Win7'
-        elif today.month == 10 and today.day == 25:
-            shell_name = 'cosplay-Taiwan'
-        elif today.month == 10 and today.day == 31:
-            shell_name = 'normal-Halloween'
-        elif today.month == 12 and today.day == 25:
-            shell_name = 'normal-Christmas'
+        today = kikka.clock.wall_time()
+        shell_name = self.get_festival_shell(today)
 
         if shell_name is not None:
             self.set_shell(shell_name)
@@ -351,6 +316,44 @@ class GhostKikka(Ghost):
         shell_name = random.choice(shell_list)
         self.set_shell(shell_name)
 
+    def get_festival_shell(self, date):
+        shell_name = None
+        # feastival
+        if date.month == 1 and date.day == 1:
+            shell_name = 'normal-Yukata'
+        elif date.month == 2 and date.day == 22:
+            shell_name = 'normal-NekoMimi'
+        elif date.month == 3 and date.day == 5:
+            shell_name = 'cosplay-SilverFox'
+        elif date.month == 3 and date.day == 9:
+            shell_name = 'cosplay-HatsuneMiku'
+        elif date.month == 3 and date.day == 28 \
+                or date.month == 4 and date.day == 29:
+            shell_name = 'cosplay-Momohime'
+        elif date.month == 4 and date.day == 8:
+            shell_name = 'cosplay-KonpakuYoumu'
+        elif date.month == 5 and date.day == 2:
+            shell_name = 'normal-Maid'
+        elif date.month == 6 and date.day == 10 \
+                or date.month == 8 and date.day == 11 \
+                or date.month == 7 and date.day == 27:
+            shell_name = 'cosplay-IzayoiSakuya'
+        elif date.month == 8 and date.day == 17:
+            shell_name = 'cosplay-InubashiriMomizi'
+        elif date.month == 9 and date.day == 3:
+            shell_name = 'cosplay-SetsukoOhara'
+        elif date.month == 10 and date.day == 13:
+            shell_name = 'private-Nurse'
+        elif date.month == 10 and date.day == 22:
+            shell_name = 'cosplay-Win7'
+        elif date.month == 10 and date.day == 25:
+            shell_name = 'cosplay-Taiwan'
+        elif date.month == 10 and date.day == 31:
+            shell_name = 'normal-Halloween'
+        elif date.month == 12 and date.day == 25:
+            shell_name = 'normal-Christmas'
+        return shell_name
+
     def get_weather(self):
         """ Example data:
         {
@@ -480,6 +483,12 @@ class GhostKikka(Ghost):
         super().on_update(update_time)
         self.on_datetime()
 
+    def get_next_update_time(self):
+        # on_datetime checks the clock once a minute
+        now = kikka.clock.wall_time()
+        next_minute = 60000 - (now.second * 1000 + now.microsecond / 1000)
+        return min(super().get_next_update_time(), next_minute)
+
     def get_shell_by_weather(self, weather):
         if weather is None:
             return []
@@ -549,8 +558,14 @@ class GhostKikka(Ghost):
         if self.is_talking():
             return
 
-        now = datetime.datetime.now()
+        now = kikka.clock.wall_time()
         if self._datetime.minute != now.minute:
+            if now.hour == 23 and now.minute == 50:
+                # load tomorrow's shell in background, so the boot time change is quick
+                shell_name = self.get_festival_shell(now + datetime.timedelta(days=1))
+                if shell_name is not None:
+                    self.preload_shell(shell_name)
+
             script = ''
             if now.hour == 7 and now.minute == 30:
                 script = r"\0\s[5]早晨%(hour)点%(minute)分了，\w4该吃早餐了哦。\e"
@@ -897,7 +912,7 @@ class GhostKikka(Ghost):
         ]
 
     def say_hello(self):
-        today = datetime.datetime.now()
+        today = kikka.clock.wall_time()
         if 4 <= today.time().hour < 6:
             # Early morning
             talk = [
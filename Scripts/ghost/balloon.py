@@ -32,9 +32,7 @@ class Balloon(FileLoader):
         self.init()
 
     def __del__(self):
-        if self._zipfile:
-            self._zipfile.close()
-            self._zipfile = None
+        self.close()
 
     def init(self):
         fp = self.get_fp('descript.txt', 'r')
@@ -52,6 +50,7 @@ class Balloon(FileLoader):
             return
 
         logging.info("load balloon: %s", self.unicode_name)
+        self.build_index()
         self._load_stylesheet()
 
         # load rect
@@ -3,6 +3,7 @@ import os
 import time
 import logging
 import datetime
+import threading
 
 from collections import OrderedDict
 from PyQt5.QtCore import Qt, QPoint, QRect, QSize, pyqtSignal, QObject
@@ -13,12 +14,14 @@ from ghost.soul import Soul
 from kikka.menu import MenuStyle
 from kikka.const import GhostEvent
 from kikka.helper import GhostEventParam
+from kikka.fileloader import ImageStore
 from ghost.window_dialog import WindowDialog
 from ghost.sakura_script import SakuraScript
 
 
 class KikkaGhostSignal(QObject):
     GhostEvent = pyqtSignal(GhostEventParam)
+    ShellPreloaded = pyqtSignal(str)
 
 
 class Ghost:
@@ -36,7 +39,9 @@ class Ghost:
         self._shell = None
         self._shells = []
         self._name2shell_id = {}
-        self._shell_image = {}
+        self._shell_image = None
+        self._preload_shells = {}
+        self._change_shell_name = None
 
         self._balloon = None
         self._balloons = []
@@ -56,7 +61,7 @@ class Ghost:
         self._current_talk_soul = 0
         self._script_wait = 0
         self._variables = {}
-        self._datetime = datetime.datetime.now()
+        self._datetime = kikka.clock.wall_time()
 
     def init(self):
         # load resource
@@ -70,8 +75,8 @@ class Ghost:
         kikka.memory.create_table(str('ghost_' + self.name))
 
         # update boot time
-        boot_last = datetime.datetime.fromtimestamp(self.memory_read('BootThis', time.time()))
-        boot_this = datetime.datetime.now()
+        boot_last = datetime.datetime.fromtimestamp(self.memory_read('BootThis', kikka.clock.wall_time().timestamp()))
+        boot_this = kikka.clock.wall_time()
         self.memory_write('BootLast', boot_last.timestamp())
         self.memory_write('BootThis', boot_this.timestamp())
 
@@ -80,6 +85,7 @@ class Ghost:
         self.set_balloon(self.memory_read('CurrentBalloonName', ''))
         self.set_is_lock_on_task_bar(self.memory_read('isLockOnTaskBar', True))
         self.signal.GhostEvent.connect(self.ghost_event)
+        self.signal.ShellPreloaded.connect(self.on_shell_preloaded)
 
         self._variables['selfname'] = self.name
         self._variables['selfname2'] = ''
@@ -112,6 +118,49 @@ class Ghost:
     # shell ###################################################################################
 
     def change_shell(self, shell_name):
+        # keep the current shell running until the new one is ready, see on_shell_preloaded
+        self._change_shell_name = shell_name
+        if self.preload_shell(shell_name) is False:
+            self._change_shell_name = None
+
+    def preload_shell(self, shell_name):
+        shell = self.get_shell_by_name(shell_name)
+        if shell is None:
+            return False
+
+        if shell_name in self._preload_shells:
+            return True
+
+        surface_ids = set()
+        for soul in self._souls.values():
+            surface_ids.add(soul.get_current_surface_id())
+            surface_ids.add(soul.get_default_surface_id())
+
+        thread = threading.Thread(target=self._preload_shell, args=(shell, surface_ids), daemon=True)
+        self._preload_shells[shell_name] = thread
+        thread.start()
+        return True
+
+    def _preload_shell(self, shell, surface_ids):
+        try:
+            start = time.perf_counter()
+            shell.load()
+            image_store = ImageStore(shell)
+            for surface_id in surface_ids:
+                for filename in shell.get_surface_image_list(surface_id):
+                    image_store.get(filename)
+            logging.info("preload shell: %s %d images %.1f ms",
+                         shell.name, image_store.get_decoded_count(), (time.perf_counter() - start) * 1000)
+        except Exception:
+            logging.exception("preload shell fail: %s", shell.name)
+        self.signal.ShellPreloaded.emit(shell.name)
+
+    def on_shell_preloaded(self, shell_name):
+        self._preload_shells.pop(shell_name, None)
+        if self._change_shell_name != shell_name:
+            return
+
+        self._change_shell_name = None
         self.hide()
         self.set_shell(shell_name)
         self.show()
@@ -125,12 +174,12 @@ class Ghost:
             if shell is None:
                 raise ValueError("setShell: load defalut shell fail.")
 
+        if self._shell is not None:
+            self.log_shell_image_stats()
+
         self._shell = shell
         self._shell.load()
-        self._shell_image = {}
-        for filename in self._shell.image_list:
-            p = os.path.join(self._shell.root_path, filename)
-            self._shell_image[filename] = self._shell.get_image(p)
+        self._shell_image = ImageStore(self._shell)
         self._menu_style = MenuStyle(self._shell.shell_menu_style, self._shell_image)
 
         for sid, soul in self._souls.items():
@@ -286,6 +335,15 @@ class Ghost:
     def get_shell_image(self):
         return self._shell_image
 
+    def log_shell_image_stats(self):
+        stats = self._shell_image.get_stats()
+        logging.info("shell image: %s decoded %d/%d, %.1f MB",
+                     self._shell.name, stats['decoded'], stats['total'], stats['bytes'] / 1024 / 1024)
+        stats = kikka.image_cache.get_stats()
+        logging.info("image cache: %d images %.1f/%.1f MB, hit %d miss %d evict %d",
+                     stats['count'], stats['bytes'] / 1024 / 1024, stats['max_bytes'] / 1024 / 1024,
+                     stats['hits'], stats['misses'], stats['evictions'])
+
     # balloon ###################################################################################
 
     def set_balloon(self, name):
@@ -340,6 +398,18 @@ class Ghost:
 
         return is_need_update
 
+    def get_next_update_time(self):
+        """ms until an animation frame, a talk character or the auto talk is due"""
+        next_time = float('inf')
+        for soul in self._souls.values():
+            next_time = min(next_time, soul.get_next_update_time())
+
+        if self._is_talking is True or len(self._tokens) > 0:
+            next_time = min(next_time, max(self._script_wait, 0))
+        else:
+            next_time = min(next_time, self.get_auto_talk_interval() - (self._now() - self._last_talk_time))
+        return next_time
+
     def memory_read(self, key, default, soul_id=0, table_name=None):
         if table_name is None:
             table_name = str('ghost_' + self.name)
@@ -352,6 +422,7 @@ class Ghost:
 
     def emit_ghost_event(self, param):
         self.signal.GhostEvent.emit(param)
+        kikka.core.wake()
 
     def ghost_event(self, param):
         is_talking = self.touch_talk(param)
@@ -422,7 +493,7 @@ class Ghost:
                 break
             elif '%' == token[0][0]:
                 command = token[0][1:]
-                now = datetime.datetime.now()
+                now = kikka.clock.wall_time()
                 if command == 'month':
                     text = str(now.minute)
                 elif command == 'day':
@@ -474,6 +545,7 @@ class Ghost:
         self._last_talk_time = self._now()
         self._is_talking = True
         self._script_wait = 0
+        kikka.core.wake()
 
     def is_talking(self):
         return self._is_talking and kikka.core.get_state() == kikka.core.APP_STATE.SHOW
@@ -483,7 +555,7 @@ class Ghost:
             soul.get_dialog().talk_clear()
 
     def _now(self):
-        return time.clock() * 1000
+        return kikka.clock.now_ms()
 
     def get_auto_talk(self):
         return ''
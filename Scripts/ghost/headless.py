@@ -0,0 +1,276 @@
+# coding=utf-8
+import time
+import logging
+import datetime
+import tracemalloc
+from array import array
+from collections import Counter
+
+from PyQt5.QtCore import QPoint, QSize
+
+import kikka
+from ghost.soul import Soul
+from ghost.window_shell import WindowShell
+from ghost.window_dialog import WindowDialog
+
+
+class HeadlessWindowShell:
+    """Stands in for WindowShell, records what would have been shown"""
+    def __init__(self, soul, win_id):
+        self._soul = soul
+        self._ghost = soul.get_ghost()
+        self.id = win_id
+
+        self._pos = QPoint(0, 0)
+        self._size = QSize(kikka.const.WindowConst.ShellWindowDefaultSize)
+        self._boxes = {}
+        self.is_visible = False
+        self.calls = Counter()
+        self.repaint_pixels = 0
+
+    def size(self):
+        return QSize(self._size)
+
+    def width(self):
+        return self._size.width()
+
+    def height(self):
+        return self._size.height()
+
+    def pos(self):
+        return QPoint(self._pos)
+
+    def move(self, *__args):
+        self.calls['move'] += 1
+        self._pos = QPoint(*__args)
+
+    def resize(self, *__args):
+        self._size = QSize(*__args)
+
+    def set_boxes(self, boxes, offset):
+        self.calls['set_boxes'] += 1
+        self._boxes = boxes
+
+    def set_image(self, image):
+        self.calls['set_image'] += 1
+        self._size = image.size()
+        self.repaint_pixels += image.width() * image.height()
+
+    def update_image(self, image, rect):
+        self.calls['update_image'] += 1
+        self.repaint_pixels += rect.width() * rect.height()
+
+    def save_shell_rect(self):
+        rect = [self._pos.x(), self._pos.y(), self._size.width(), self._size.height()]
+        self._soul.memory_write('ShellRect', rect)
+
+    def get_mouse_pose(self):
+        return 0, 0
+
+    def show(self):
+        self.calls['show'] += 1
+        self.is_visible = True
+        param = kikka.helper.make_ghost_event_param(
+            self._ghost.id, self._soul.id, kikka.const.GhostEvent.Shell_Show, 'Show')
+        self._ghost.emit_ghost_event(param)
+
+    def hide(self):
+        self.calls['hide'] += 1
+        self.is_visible = False
+
+    def close(self):
+        self.hide()
+
+
+class HeadlessWindowDialog:
+    """Stands in for WindowDialog, keeps the talk text instead of drawing it"""
+    DIALOG_MAIN_MENU = WindowDialog.DIALOG_MAIN_MENU
+    DIALOG_TALK = WindowDialog.DIALOG_TALK
+    DIALOG_INPUT = WindowDialog.DIALOG_INPUT
+
+    def __init__(self, soul, win_id):
+        self._soul = soul
+        self._ghost = soul.get_ghost()
+        self.id = win_id
+        self.isFlip = False
+
+        self._pages = {}
+        self._current_page = self.DIALOG_MAIN_MENU
+        self._text = ''
+        self.talks = []
+        self.is_visible = False
+        self.calls = Counter()
+
+    def initialed(self):
+        pass
+
+    def set_page(self, tag, qwidget):
+        self._pages[tag] = qwidget
+
+    def set_balloon(self, balloon):
+        self.calls['set_balloon'] += 1
+
+    def set_frameless_window_hint(self, boolean):
+        pass
+
+    def set_rect(self, rect):
+        pass
+
+    def update_position(self):
+        pass
+
+    def repaint(self):
+        self.calls['repaint'] += 1
+
+    def get_talk_label(self):
+        return None
+
+    def show_input_box(self, title, default='', callback=None):
+        self.calls['show_input_box'] += 1
+
+    def show(self, pageTag=None):
+        self.calls['show'] += 1
+        self._current_page = pageTag if pageTag is not None else self.DIALOG_MAIN_MENU
+        self.is_visible = True
+        param = kikka.helper.make_ghost_event_param(
+            self._ghost.id, self._soul.id, kikka.const.GhostEvent.Dialog_Show, 'Show')
+        param.data['pageTag'] = self._current_page
+        self._ghost.emit_ghost_event(param)
+
+    def hide(self):
+        self.calls['hide'] += 1
+        self.is_visible = False
+
+    def talk_clear(self):
+        if self._text != '':
+            self.talks.append(self._text)
+        self._text = ''
+
+    def on_talk(self, message, speed=50):
+        self.calls['on_talk'] += 1
+        self._text += message
+
+
+_request = None
+
+
+def _offline_request(*args, **kwargs):
+    import requests
+    raise requests.ConnectionError("headless: network is disabled")
+
+
+def install():
+    """create the windows of new souls as headless stubs, and keep ghosts off the network"""
+    global _request
+    Soul.window_shell_class = HeadlessWindowShell
+    Soul.window_dialog_class = HeadlessWindowDialog
+
+    try:
+        import requests
+    except ImportError:
+        return
+    if _request is None:
+        # requests.get() and the others all go through Session.request
+        _request = requests.Session.request
+        requests.Session.request = _offline_request
+
+
+def uninstall():
+    global _request
+    Soul.window_shell_class = WindowShell
+    Soul.window_dialog_class = WindowDialog
+
+    if _request is not None:
+        import requests
+        requests.Session.request = _request
+        _request = None
+
+
+class HeadlessRunner:
+    """Run a ghost without windows on the virtual clock, and measure the cost of each core run
+
+    Qt still needs a QApplication, use QT_QPA_PLATFORM=offscreen where there is no display.
+    """
+    def __init__(self, ghost_id=0, trace_memory=True, wall_start=None):
+        self.ghost_id = ghost_id
+        self.trace_memory = trace_memory
+        self.wall_start = wall_start
+        self.ghost = None
+
+        # wall minutes that had a core run, and minutes the ghost handled, see Ghost._datetime
+        self._run_minutes = set()
+        self._minute_events = 0
+
+        # an array keeps the samples themselves out of the traced memory growth
+        self._tick_costs = array('d')
+        self._memory = []
+
+    def start(self):
+        install()
+        kikka.clock.use_virtual_clock(wall_start=self.wall_start)
+        if kikka.ghost.get_ghost_count() <= 0:
+            kikka.ghost.scan_ghost(kikka.path.GHOSTS)
+
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+        gid = kikka.core.add_ghost(kikka.ghost.get_ghost(self.ghost_id))
+        self.ghost = kikka.core.get_ghost(gid)
+        self.ghost.show()
+        logging.info("headless: run ghost %s", self.ghost.name)
+        return self.ghost
+
+    def run(self, seconds, max_step=None, sample_interval=60):
+        """advance the virtual clock by seconds, running the core whenever it is due"""
+        end = kikka.clock.now_ms() + seconds * 1000
+        next_sample = kikka.clock.now_ms()
+        while kikka.clock.now_ms() < end:
+            step = kikka.core.get_next_update_time()
+            if max_step is not None:
+                step = min(step, max_step)
+            kikka.clock.advance(min(step, end - kikka.clock.now_ms()))
+
+            last_datetime = getattr(self.ghost, '_datetime', None)
+            start = time.process_time()
+            kikka.core.run()
+            self._tick_costs.append((time.process_time() - start) * 1000)
+
+            now = kikka.clock.wall_time()
+            self._run_minutes.add(now.replace(second=0, microsecond=0))
+            if getattr(self.ghost, '_datetime', None) is not last_datetime:
+                self._minute_events += 1
+
+            if self.trace_memory and kikka.clock.now_ms() >= next_sample:
+                self._memory.append(tracemalloc.get_traced_memory()[0])
+                next_sample += sample_interval * 1000
+        return self.get_stats()
+
+    def _get_wall_start(self):
+        return kikka.clock.wall_time() - datetime.timedelta(milliseconds=kikka.clock.now_ms())
+
+    def get_talks(self):
+        talks = []
+        for soul_id in range(self.ghost.get_soul_count()):
+            talks += self.ghost.get_soul(soul_id).get_dialog().talks
+        return talks
+
+    def get_stats(self):
+        costs = sorted(self._tick_costs)
+        stats = {
+            'virtual_seconds': kikka.clock.now_ms() / 1000,
+            'ticks': len(costs),
+            'cpu_ms': sum(costs),
+            'tick_p50_ms': costs[len(costs) // 2] if costs else 0,
+            'tick_p95_ms': costs[int(len(costs) * 0.95)] if costs else 0,
+            'tick_max_ms': costs[-1] if costs else 0,
+            'talks': len(self.get_talks()),
+            'wall_start': self._get_wall_start().isoformat(),
+            'minutes': int(kikka.clock.now_ms() // 60000),
+            'run_minutes': len(self._run_minutes),
+            'minute_events': self._minute_events,
+        }
+        if self._memory:
+            stats['memory_start'] = self._memory[0]
+            stats['memory_end'] = self._memory[-1]
+            stats['memory_peak'] = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else max(self._memory)
+        return stats
@@ -4,7 +4,9 @@ import sys
 import json
 import logging
 import importlib
+from concurrent.futures import ThreadPoolExecutor
 
+import kikka
 from kikka.helper import Singleton
 from kikka.fileloader import FileLoader
 from ghost.shell import Shell
@@ -13,6 +15,7 @@ from ghost.balloon import Balloon
 
 class KikkaGhost(Singleton):
     isDebug = False
+    isParallelScan = True
 
     def __init__(self):
         self._ghosts = []
@@ -26,32 +29,48 @@ class KikkaGhost(Singleton):
             return
         self._ghost_dir = ghost_dir
 
+        # descriptors are read in parallel, but ghosts are imported one by one since it changes sys.path
         gid = 0
         names = []
-        for parent, dir_names, file_names in os.walk(ghost_dir):
-            li = list(dir_names)
-            for file in file_names:
-                ext = os.path.splitext(file)[1]
-                if ext == '.zip':
-                    li.append(file)
-
-            for ghost_name in li:
-                ghost_path = os.path.join(parent, ghost_name)
-                ghost = self._load_ghost(ghost_path, gid)
-                if ghost is None:
-                    continue
-
-                if ghost.name in names:
-                    logging.warning("%s(%s) load FAIL. name has been exist", ghost.name, ghost_path)
-                    continue
-
-                logging.info("add ghost: %s", ghost.name)
-                self._ghosts.append(ghost)
-                self._name2id[ghost.name] = gid
-                names.append(ghost.name)
-                gid += 1
+        for ghost_path, descript in self._scan(ghost_dir, self._read_ghost_descript):
+            if descript is None:
+                continue
+
+            ghost = self._load_ghost(descript[0], descript[1], gid)
+            if ghost is None:
+                continue
+
+            if ghost.name in names:
+                logging.warning("%s(%s) load FAIL. name has been exist", ghost.name, ghost_path)
+                continue
+
+            logging.info("add ghost: %s", ghost.name)
+            self._ghosts.append(ghost)
+            self._name2id[ghost.name] = gid
+            names.append(ghost.name)
+            gid += 1
         logging.info("ghost scan finish: count %d", len(self._ghosts))
 
+    def _scan(self, root_dir, load_func):
+        """call load_func for every folder and zip directly in root_dir, return [(path, result)] in listing order"""
+        dir_paths = []
+        zip_paths = []
+        with os.scandir(root_dir) as it:
+            for entry in it:
+                if entry.is_dir():
+                    dir_paths.append(entry.path)
+                elif entry.is_file() and os.path.splitext(entry.name)[1] == '.zip':
+                    zip_paths.append(entry.path)
+        paths = dir_paths + zip_paths
+
+        if self.isParallelScan is False or kikka.const.ScanThreadCount <= 1 or len(paths) <= 1:
+            return [(path, load_func(path)) for path in paths]
+
+        workers = min(kikka.const.ScanThreadCount, len(paths))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # map() keeps the order of paths, so the IDs do not depend on which thread finishes first
+            return list(zip(paths, executor.map(load_func, paths)))
+
     def _check_ghost_descript(self, ghost_data, file_loader):
         config = ghost_data.get("config", None)
         errlog = "invalid syntax in ghost's descript.json: "
@@ -72,14 +91,14 @@ class KikkaGhost(Singleton):
             logging.info(errlog + "lost key['config']['main']")
             return False
 
-        if file_loader.get_fp("Ghost.zip", "r"):
+        if file_loader.has_file("Ghost.zip"):
             fl = FileLoader(os.path.join(file_loader.root_path, "Ghost.zip"))
-            if not fl.is_initialized or not fl.is_zip or fl.get_fp("%s.pyc" % main, "r"):
+            if not fl.is_initialized or not fl.is_zip or fl.has_file("%s.pyc" % main):
                 logging.info(errlog + "illegal file key['config']['main']=" + "Ghost.zip")
                 return False
         else:
             path = os.path.join("Ghost", main)
-            if not file_loader.get_fp(path, "r"):
+            if not file_loader.has_file(path):
                 logging.info(errlog + "lost file key['config']['main']=" + path)
                 return False
 
@@ -91,7 +110,7 @@ class KikkaGhost(Singleton):
 
         return True
 
-    def _load_ghost(self, ghost_path, ghost_id):
+    def _read_ghost_descript(self, ghost_path):
         file_loader = FileLoader(ghost_path)
         if not file_loader.is_initialized:
             return None
@@ -101,14 +120,17 @@ class KikkaGhost(Singleton):
             return None
 
         data = json.load(fp)
+        fp.close()
         if self._check_ghost_descript(data, file_loader) is False:
             return None
+        return file_loader, data
 
+    def _load_ghost(self, file_loader, data, ghost_id):
         main = data["config"]["main"]
         main = os.path.splitext(main)[0]
         main = "Ghost.%s" % main
 
-        if file_loader.get_fp("Ghost.zip", "r"):
+        if file_loader.has_file("Ghost.zip"):
             ghost_root = os.path.join(file_loader.root_path, "Ghost.zip")
         else:
             ghost_root = file_loader.root_path
@@ -157,28 +179,18 @@ class KikkaGhost(Singleton):
         sid = 0
         names = {}
         shells = []
-        for parent, dir_names, file_names in os.walk(shell_dir):
-            li = list(dir_names)
-            for file in file_names:
-                ext = os.path.splitext(file)[1]
-                if ext == '.zip':
-                    li.append(file)
-
-            for shell_name in li:
-                shell_path = os.path.join(parent, shell_name)
-                shell = Shell(shell_path)
-
-                if shell.is_initialized is False:
-                    continue
+        for shell_path, shell in self._scan(shell_dir, Shell):
+            if shell.is_initialized is False:
+                continue
 
-                if shell.name in names:
-                    logging.warning("shell %s(%s) load FAIL. name has been exist", shell.name, shell_path)
-                    continue
+            if shell.name in names:
+                logging.warning("shell %s(%s) load FAIL. name has been exist", shell.name, shell_path)
+                continue
 
-                logging.info("add shell: %s", shell.name)
-                shells.append(shell)
-                names[shell.name] = sid
-                sid += 1
+            logging.info("add shell: %s", shell.name)
+            shells.append(shell)
+            names[shell.name] = sid
+            sid += 1
 
         logging.info("shell scan finish: count %d", len(shells))
         return shells, names
@@ -191,28 +203,18 @@ class KikkaGhost(Singleton):
         bid = 0
         names = {}
         balloons = []
-        for parent, dir_names, file_names in os.walk(balloon_dir):
-            li = list(dir_names)
-            for file in file_names:
-                ext = os.path.splitext(file)[1]
-                if ext == '.zip':
-                    li.append(file)
-
-            for balloon_name in li:
-                balloon_path = os.path.join(parent, balloon_name)
-                balloon = Balloon(balloon_path)
-
-                if balloon.is_initialized is False:
-                    continue
-
-                if balloon.name in names:
-                    logging.warning("balloon %s(%s) load FAIL. name has been exist", balloon.name, balloon_path)
-                    continue
-
-                logging.info("add balloon: %s", balloon.name)
-                balloons.append(balloon)
-                names[balloon.name] = bid
-                bid += 1
+        for balloon_path, balloon in self._scan(balloon_dir, Balloon):
+            if balloon.is_initialized is False:
+                continue
+
+            if balloon.name in names:
+                logging.warning("balloon %s(%s) load FAIL. name has been exist", balloon.name, balloon_path)
+                continue
+
+            logging.info("add balloon: %s", balloon.name)
+            balloons.append(balloon)
+            names[balloon.name] = bid
+            bid += 1
 
         logging.info("balloon count: %d", len(balloons))
         return balloons, names
@@ -1,17 +1,32 @@
 import os
 import re
+import time
 import logging
+import threading
 import collections
 from enum import Enum
 from PyQt5.QtCore import QPoint, QRect
 
 from kikka.fileloader import FileLoader
+from ghost.shell_cache import ShellCache
 from ghost.struct import AuthorInfo, ShellMenuStyle, ShellSetting, BindGroup
 from kikka.const import WindowConst, SurfaceNameEnum
 from .struct import Element, CollisionBox, AnimationData, Pattern, EPatternType
 
+COMMENT_PREFIX = (r'\\', '//', '#')
+
+# the parsed data saved in ShellCache
+CACHE_DESCRIPT_FIELDS = [
+    'name', 'type', 'catalog', 'description', 'unicode_name', 'author', 'setting', 'shell_menu_style'
+]
+CACHE_SURFACES_FIELDS = [
+    'version', 'max_width', 'collision_sort', 'animation_sort', 'alias', '_surfaces', '_surfacesName'
+]
+
 
 class Shell(FileLoader):
+    is_alpha_convert = True
+
     def __init__(self, root_path):
         FileLoader.__init__(self, root_path)
         self.is_loaded = False
@@ -34,15 +49,21 @@ class Shell(FileLoader):
 
         self._surfaces = {}
         self._surfacesName = {}
+        self._load_lock = threading.Lock()
+        self._cache = ShellCache(root_path)
 
         self.init()
 
     def __del__(self):
-        if self._zipfile:
-            self._zipfile.close()
-            self._zipfile = None
+        self.close()
 
     def init(self):
+        signature = self._get_cache_signature()
+        descript, _ = self._cache.read(signature)
+        if descript is not None:
+            self._set_cache_data(descript)
+            return
+
         fp = self.get_fp('descript.txt', 'r')
         if fp is None:
             self.is_initialized = False
@@ -52,15 +73,47 @@ class Shell(FileLoader):
 
         if self.name == '':
             self.name = os.path.basename(self.root_path)
+        self._cache.write(signature, self._get_cache_data(CACHE_DESCRIPT_FIELDS))
 
     def load(self):
-        if self.is_loaded:
-            return
-        logging.info("load shell: %s", self.unicode_name)
-        self._load_surfaces()
-        self._load_surface_table()
-        self._sort_data()
-        self.is_loaded = True
+        # shells may be loaded by the preload thread and the main thread at the same time
+        with self._load_lock:
+            if self.is_loaded:
+                return
+
+            start = time.perf_counter()
+            self.build_index()
+            signature = self._get_cache_signature()
+            _, surfaces = self._cache.read(signature, with_surfaces=True)
+            if surfaces is not None:
+                self._set_cache_data(surfaces['data'])
+                logging.info("load shell: %s from cache %.1f ms (parse %.1f ms)",
+                             self.unicode_name, (time.perf_counter() - start) * 1000, surfaces['parse_time'])
+            else:
+                self._load_surfaces()
+                self._load_surface_table()
+                self._sort_data()
+                parse_time = (time.perf_counter() - start) * 1000
+                logging.info("load shell: %s parse %.1f ms", self.unicode_name, parse_time)
+
+                surfaces = {'data': self._get_cache_data(CACHE_SURFACES_FIELDS), 'parse_time': parse_time}
+                self._cache.write(signature, self._get_cache_data(CACHE_DESCRIPT_FIELDS), surfaces)
+            self.is_loaded = True
+
+    def _get_cache_signature(self):
+        filenames = ['descript.txt', 'surfacetable.txt', 'surfaces.txt']
+        i = 2
+        while self.get_file_stamp('surfaces%d.txt' % i) is not None:
+            filenames.append('surfaces%d.txt' % i)
+            i += 1
+        return tuple((filename, self.get_file_stamp(filename)) for filename in filenames)
+
+    def _get_cache_data(self, fields):
+        return {field: getattr(self, field) for field in fields}
+
+    def _set_cache_data(self, data):
+        for field, value in data.items():
+            setattr(self, field, value)
 
     def reload(self):
         self.init()
@@ -81,10 +134,8 @@ class Shell(FileLoader):
             if isinstance(line, bytes):
                 line = line.decode('utf-8')
 
-            line = line.replace("\n", "").replace("\r", "")
-            line = line.strip(' ')
-
-            if line == '' or line.find(r'\\') == 0 or line.find('//') == 0 or line.find('#') == 0:
+            line = line.strip(' \r\n')
+            if line == '' or line.startswith(COMMENT_PREFIX):
                 continue
 
             if line == '{':
@@ -348,13 +399,7 @@ class Shell(FileLoader):
         pass
 
     def _load_surface_table(self):
-        if self.is_zip:
-            name, ext = os.path.splitext(os.path.basename(self.root_path))
-            filename = os.path.join(name, 'surfacetable.txt')
-        else:
-            filename = os.path.join(self.root_path, 'surfacetable.txt')
-
-        fp = self.get_fp(filename, 'r')
+        fp = self.get_fp('surfacetable.txt', 'r')
         if fp is None:
             return False
 
@@ -380,42 +425,22 @@ class Shell(FileLoader):
         return True
 
     def _load_surfaces(self):
-        i = 2
-        if self.is_zip:
-            name, ext = os.path.splitext(os.path.basename(self.root_path))
-            fp = self.get_fp('surfaces.txt', 'r')
-            if fp is None:
-                return False
-
-            surfaces_map = self._open_surfaces(fp)
-            fp.close()
+        fp = self.get_fp('surfaces.txt', 'r')
+        if fp is None:
+            return False
 
-            while True:
-                fp = self.get_fp('surfaces%d.txt' % i, 'r')
-                if fp is None:
-                    break
+        surfaces_map = self._open_surfaces(fp)
+        fp.close()
 
-                surfaces_map = self._open_surfaces(fp, surfaces_map)
-                fp.close()
-                i = i + 1
-        else:
-            filename = os.path.join(self.root_path, 'surfaces.txt')
-            fp = self.get_fp(filename, 'r')
+        i = 2
+        while True:
+            fp = self.get_fp('surfaces%d.txt' % i, 'r')
             if fp is None:
-                return False
+                break
 
-            surfaces_map = self._open_surfaces(fp)
+            surfaces_map = self._open_surfaces(fp, surfaces_map)
             fp.close()
-
-            while True:
-                filename = os.path.join(self.root_path, 'surfaces%d.txt' % i)
-                fp = self.get_fp(filename, 'r')
-                if fp is None:
-                    break
-
-                surfaces_map = self._open_surfaces(fp, surfaces_map)
-                fp.close()
-                i = i + 1
+            i = i + 1
 
         for key, values in surfaces_map.items():
             self._surfaces[key] = Surface(key, values)
@@ -448,6 +473,32 @@ class Shell(FileLoader):
             logging.error("getSurface: surfaceID: %d NOT exist" % surfaces_id)
             return None
 
+    def get_surface_image_name(self, surface_id):
+        for filename in ["surface%04d.png" % surface_id, "surface%d.png" % surface_id]:
+            if self.has_file(filename):
+                return filename
+        return None
+
+    def get_surface_image_list(self, surface_id):
+        """all image files needed to draw the surface and its animations"""
+        surface_ids = self.alias[surface_id] if surface_id in self.alias else [surface_id]
+        image_list = []
+        for sid in surface_ids:
+            surface = self._surfaces.get(sid, None)
+            if surface is None:
+                continue
+
+            if len(surface.elements) > 0:
+                image_list += [ele.filename for ele in surface.elements.values()]
+            else:
+                image_list.append(self.get_surface_image_name(sid))
+
+            for ani in surface.animations.values():
+                for pattern in ani.patterns.values():
+                    if pattern.is_control_pattern() is False and pattern.surface_id != -1:
+                        image_list.append(self.get_surface_image_name(pattern.surface_id))
+        return [filename for filename in image_list if filename is not None]
+
     def get_surface_name_list(self):
         return self._surfacesName
 
@@ -565,11 +616,46 @@ class Surface:
             elif matchtype == SurfaceMatchLine.BasePosX:
                 self.base_pos.setX(int(params[0]))
 
-            elif matchtype == SurfaceMatchLine.BasePosX:
+            elif matchtype == SurfaceMatchLine.BasePosY:
                 self.base_pos.setY(int(params[0]))
         pass  # exit for
 
 
+_PAINT_TYPE = r'base|overlay|overlayfast|replace|interpolate|asis|move|bind|add|reduce'
+
+# element[ID],[PaintType],[filename],[X],[Y]
+_ELEMENT_RE = re.compile(
+    r'^element(\d+),(' + _PAINT_TYPE + r'|insert),(\w+.png),(\d+),(\d+)$')
+
+# [aID]interval,[interval]
+_ANIMATION_INTERVAL_RE = re.compile(
+    r'^(?:animation)?(\d+).?interval,(sometimes|rarely|random,\d+|periodic,'
+    r'\d+[.][0-9]*|always|runonce|never|yen-e|talk,\d+|bind)$')
+
+# [aID]pattern[pID],[surfaceID],[time],[methodType],[[aID1], [aID2], ...]
+# [aID]pattern[pID],[surfaceID],[time],[methodType],[X],[Y]
+_ANIMATION_PATTERN_RE = re.compile(
+    r'^(\d+)pattern(\d+),(\-?\d+),(\d+),'
+    r'(?:(insert|start|stop|alternativestart|alternativestop),(?:[\[\(]?((?:\d+[\.\,])*\d+)[\]\)]?)'
+    r'|(' + _PAINT_TYPE + r'),(\-?\d+),(\-?\d+))$')
+
+# animation[aID].pattern[pID],[methodType],[surfaceID],[time],[X],[Y]
+_ANIMATION_PATTERN_NEW_RE = re.compile(
+    r'^animation(\d+).pattern(\d+),(' + _PAINT_TYPE + r'),(\-?\d+),(\d+),(\-?\d+),(\-?\d+)$')
+
+# [aID]option,exclusive
+_ANIMATION_OPTION_RE = re.compile(r'^(\d+)option,exclusive$')
+
+# Collision[cID],[sX],[sY],[eX],[eY],[Tag]
+_COLLISION_RE = re.compile(r'^collision(\d+),(\d+),(\d+),(\d+),(\d+),(\w+)$')
+
+# point.centerx,[int]
+_POINT_RE = re.compile(
+    r'^point\.(centerx|centery|kinoko\.centerx|kinoko\.centery|base_pos\.centerx|base_pos\.centery),(\d+)$')
+
+_DIGITS = '0123456789'
+
+
 class SurfaceMatchLine(Enum):
     Unknown = 0
     Elements = 100
@@ -591,102 +677,60 @@ class SurfaceMatchLine(Enum):
 
     @staticmethod
     def match_line(line):
+        # pick the rule by the line prefix, so every line is matched once
+        if line[:1].isdigit():
+            body = line.lstrip(_DIGITS)
+            if body.startswith('pattern'):
+                res = _ANIMATION_PATTERN_RE.match(line)
+                if res is not None:
+                    params = res.groups()
+                    if params[4] is not None:
+                        return SurfaceMatchLine.AnimationPatternAlternative, params[:6]
+                    return SurfaceMatchLine.AnimationPattern, params[:4] + params[6:]
+            elif body.startswith('option'):
+                res = _ANIMATION_OPTION_RE.match(line)
+                if res is not None:
+                    return SurfaceMatchLine.AnimationOptionExclusive, res.groups()
+            else:
+                res = _ANIMATION_INTERVAL_RE.match(line)
+                if res is not None:
+                    return SurfaceMatchLine.AnimationInterval, res.groups()
+
+        elif line.startswith('element'):
+            res = _ELEMENT_RE.match(line)
+            if res is not None:
+                return SurfaceMatchLine.Elements, res.groups()
+
+        elif line.startswith('animation'):
+            body = line[9:].lstrip(_DIGITS)
+            if body[1:8] == 'pattern':
+                res = _ANIMATION_PATTERN_NEW_RE.match(line)
+                if res is not None:
+                    return SurfaceMatchLine.AnimationPatternNew, res.groups()
+            else:
+                res = _ANIMATION_INTERVAL_RE.match(line)
+                if res is not None:
+                    return SurfaceMatchLine.AnimationInterval, res.groups()
+
+        elif line.startswith('collision'):
+            res = _COLLISION_RE.match(line)
+            if res is not None:
+                return SurfaceMatchLine.CollisionBoxes, res.groups()
 
-        # Element
-        # element[ID],[PaintType],[filename],[X],[Y]
-        res = re.match(
-            r'^element(\d+),(base|overlay|overlayfast|replace|interpolate|asis|move|bind|add|reduce|insert),'
-            r'(\w+.png),(\d+),(\d+)$',
-            line)
-        if res is not None:
-            return SurfaceMatchLine.Elements, res.groups()
-
-        # Animation Interval
-        # [aID]interval,[interval]
-        res = re.match(
-            r'^(?:animation)?(\d+).?interval,(sometimes|rarely|random,\d+|periodic,'
-            r'\d+[.][0-9]*|always|runonce|never|yen-e|talk,\d+|bind)$',
-            line)
-        if res is not None:
-            return SurfaceMatchLine.AnimationInterval, res.groups()
-
-        # Animation Pattern Alternative
-        # [aID]pattern[pID],[surfaceID],[time],[methodType],[[aID1], [aID2], ...]
-        res = re.match(
-            r'^(\d+)pattern(\d+),(\-?\d+),(\d+),(insert|start|stop|alternativestart|alternativestop),'
-            r'(?:[\[\(]?((?:\d+[\.\,])*\d+)[\]\)]?)$',
-            line)
-        if res is not None:
-            return SurfaceMatchLine.AnimationPatternAlternative, res.groups()
-
-        # Animation Pattern Normal
-        # [aID]pattern[pID],[surfaceID],[time],[methodType],[X],[Y]
-        res = re.match(
-            r'^(\d+)pattern(\d+),(\-?\d+),(\d+),'
-            r'(base|overlay|overlayfast|replace|interpolate|asis|move|bind|add|reduce),(\-?\d+),(\-?\d+)$',
-            line)
-        if res is not None:
-            return SurfaceMatchLine.AnimationPattern, res.groups()
-
-        # Animation Pattern New
-        # animation[aID].pattern[pID],[methodType],[surfaceID],[time],[X],[Y]
-        res = re.match(
-            r'^animation(\d+).pattern(\d+),(base|overlay|overlayfast|replace|interpolate|asis|move|bind|add|reduce),'
-            r'(\-?\d+),(\d+),(\-?\d+),(\-?\d+)$',
-            line)
-        if res is not None:
-            return SurfaceMatchLine.AnimationPatternNew, res.groups()
-
-        # Animation Option exclusive
-        # [aID]option,exclusive
-        res = re.match(r'^(\d+)option,exclusive$', line)
-        if res is not None:
-            return SurfaceMatchLine.AnimationOptionExclusive, res.groups()
-
-        # CollisionBox
-        # Collision[cID],[sX],[sY],[eX],[eY],[Tag]
-        res = re.match(r'^collision(\d+),(\d+),(\d+),(\d+),(\d+),(\w+)$', line)
-        if res is not None:
-            return SurfaceMatchLine.CollisionBoxes, res.groups()
-
-        # Surface Center X
-        # point.centerx,[int]
-        res = re.match(r'^point.centerx,(\d+)$', line)
-        if res is not None:
-            return SurfaceMatchLine.SurfaceCenterX, res.groups()
-
-        # Surface Center Y
-        # point.centery,[int]
-        res = re.match(r'^point.centery,(\d+)$', line)
-        if res is not None:
-            return SurfaceMatchLine.SurfaceCenterY, res.groups()
-
-        # Kinoko Center X
-        # point.kinoko.centerx,[int]
-        res = re.match(r'^point.kinoko.centerx,(\d+)$', line)
-        if res is not None:
-            return SurfaceMatchLine.KinokoCenterX, res.groups()
-
-        # Kinoko Center Y
-        # point.kinoko.centery,[int]
-        res = re.match(r'^point.kinoko.centery,(\d+)$', line)
-        if res is not None:
-            return SurfaceMatchLine.KinokoCenterY, res.groups()
-
-        # basepos X
-        # point.base_pos.centerx,[int]
-        res = re.match(r'^point.base_pos.centerx,(\d+)$', line)
-        if res is not None:
-            return SurfaceMatchLine.BasePosX, res.groups()
-
-        # basepos Y
-        # point.base_pos.centery,[int]
-        res = re.match(r'^point.base_pos.centery,(\d+)$', line)
-        if res is not None:
-            return SurfaceMatchLine.BasePosY, res.groups()
+        elif line.startswith('point'):
+            res = _POINT_RE.match(line)
+            if res is not None:
+                return _POINT_TYPE[res.group(1)], res.groups()[1:]
 
         # Unknown
         return SurfaceMatchLine.Unknown, None
 
-    pass
 
+_POINT_TYPE = {
+    'centerx': SurfaceMatchLine.SurfaceCenterX,
+    'centery': SurfaceMatchLine.SurfaceCenterY,
+    'kinoko.centerx': SurfaceMatchLine.KinokoCenterX,
+    'kinoko.centery': SurfaceMatchLine.KinokoCenterY,
+    'base_pos.centerx': SurfaceMatchLine.BasePosX,
+    'base_pos.centery': SurfaceMatchLine.BasePosY,
+}
@@ -0,0 +1,80 @@
+# coding=utf-8
+import os
+import struct
+import pickle
+import hashlib
+import logging
+
+import kikka
+
+CACHE_MAGIC = b'KSHC'
+CACHE_VERSION = 2
+_HEADER = struct.Struct('<4sH16s')
+
+# the pickles hold objects of these modules, a change to their code makes old caches stale
+PARSER_FILES = ['shell.py', 'struct.py', 'shell_cache.py']
+
+
+def _get_code_stamp():
+    md5 = hashlib.md5()
+    for name in PARSER_FILES:
+        try:
+            with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), name), 'rb') as fp:
+                md5.update(fp.read())
+        except OSError:
+            # running from compiled files only, CACHE_VERSION still guards the cache
+            md5.update(name.encode())
+    return md5.digest()
+
+
+CODE_STAMP = _get_code_stamp()
+
+
+class ShellCache:
+    """Parsed shell data saved beside the text sources.
+
+    The file holds two pickles after the header: the descript part, which is read when the shell is scanned,
+    and the surfaces part, which is read only when the shell is loaded.
+    Both are dropped when the stamp of any source file or the code of the parser changes,
+    a cache that can not be unpickled is read as a miss.
+    """
+    def __init__(self, root_path):
+        name = "shell_%s.cache" % kikka.helper.get_short_md5(root_path)
+        self.file_path = os.path.join(kikka.path.CACHE, name)
+
+    def read(self, signature, with_surfaces=False):
+        try:
+            with open(self.file_path, 'rb') as fp:
+                magic, version, code_stamp = _HEADER.unpack(fp.read(_HEADER.size))
+                if magic != CACHE_MAGIC or version != CACHE_VERSION or code_stamp != CODE_STAMP:
+                    return None, None
+
+                cache_signature, descript = pickle.load(fp)
+                if cache_signature != signature:
+                    return None, None
+
+                surfaces = pickle.load(fp) if with_surfaces else None
+                return descript, surfaces
+        except FileNotFoundError:
+            return None, None
+        except Exception:
+            logging.warning("read shell cache fail: %s", self.file_path, exc_info=True)
+            return None, None
+
+    def write(self, signature, descript, surfaces=None):
+        temp_path = "%s.%d.tmp" % (self.file_path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+            with open(temp_path, 'wb') as fp:
+                fp.write(_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, CODE_STAMP))
+                pickle.dump((signature, descript), fp, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(surfaces, fp, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self.file_path)
+        except Exception:
+            # do not leave a partly written file behind on every failed write
+            try:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            except OSError:
+                pass
+            logging.warning("write shell cache fail: %s", self.file_path, exc_info=True)
@@ -1,20 +1,23 @@
 
 import logging
-import time
 import random
 from collections import OrderedDict
 
-from PyQt5.QtCore import Qt, QPoint, QRect, QSize
-from PyQt5.QtGui import QImage, QPainter
+from PyQt5.QtCore import QPoint, QRect, QSize
+from PyQt5.QtGui import QImage
 from PyQt5.QtWidgets import QActionGroup
 
 import kikka
 from kikka.const import WindowConst
+from kikka.image_cache import ImageCache
 from ghost.window_shell import WindowShell
 from ghost.window_dialog import WindowDialog
 
 
 class Soul:
+    # replaced by ghost.headless to run without windows
+    window_shell_class = WindowShell
+    window_dialog_class = WindowDialog
 
     def __init__(self, ghost, soul_id, surface_id=0):
         self.id = soul_id
@@ -36,13 +39,15 @@ class Soul:
         self._base_rect = QRect()
         self._base_image = None
         self._soul_image = None
+        self._patch_image = None
         self._surface_image = None
         self._center_point = QPoint()
+        self._base_images = ImageCache(kikka.const.BaseImageCacheSize)
 
         self.init()
 
     def init(self):
-        self._window_shell = WindowShell(self, self.id)
+        self._window_shell = self.window_shell_class(self, self.id)
         self._size = self._window_shell.size()
 
         if self.id == 0:
@@ -58,7 +63,7 @@ class Soul:
             if shell_submenu:
                 shell_submenu.check_action(current_shell.unicode_name, True)
 
-        self._window_dialogs.append(WindowDialog(self, 0))
+        self._window_dialogs.append(self.window_dialog_class(self, 0))
         balloon = self._ghost.get_current_balloon()
         if balloon is not None:
             for dlg in self._window_dialogs:
@@ -249,6 +254,7 @@ class Soul:
     def animation_start(self, aid):
         if aid in self._animations.keys():
             self._animations[aid].start()
+            kikka.core.wake()
         else:
             logging.warning("animation %d NOT exist!" % aid)
 
@@ -285,6 +291,7 @@ class Soul:
             logging.info("setSurface: %3d - %s(%s)", surface.id, surface.name, surface.unicode_name)
             self._surface = surface
             self.reset_animation(surface.animations)
+            kikka.core.wake()
         self.update_draw_rect()
         self.repaint()
         self._window_shell.set_boxes(shell.get_collision_boxes(surface_id), self._draw_offset)
@@ -293,6 +300,9 @@ class Soul:
     def set_default_surface(self):
         self.set_surface(self._default_surface_id)
 
+    def get_default_surface_id(self):
+        return self._default_surface_id
+
     def get_current_surface(self):
         return self._surface
 
@@ -341,15 +351,49 @@ class Soul:
     # ################################################################
 
     def on_update(self, update_time):
+        # animations may start or stop each other, so take all states before updating any of them
+        states = {aid: (ani.get_draw_state(), ani.get_draw_rect()) for aid, ani in self._animations.items()}
+
         is_need_update = False
         for aid, ani in self._animations.items():
             if ani.on_update(update_time) is True:
                 is_need_update = True
 
         if is_need_update is True:
-            self.repaint()
+            dirty_rect = QRect()
+            for aid, ani in self._animations.items():
+                state, rect = states[aid] if aid in states else (None, QRect())
+                if ani.get_draw_state() != state:
+                    dirty_rect = dirty_rect.united(rect).united(ani.get_draw_rect())
+            self.repaint_dirty(dirty_rect)
         return is_need_update
 
+    def get_next_update_time(self):
+        next_time = float('inf')
+        for aid, ani in self._animations.items():
+            next_time = min(next_time, ani.get_next_update_time())
+        return next_time
+
+    def repaint_dirty(self, dirty_rect):
+        """redraw the animations inside dirty_rect on top of the base image, the rest of the image is kept"""
+        if self._soul_image is None or kikka.core.isDebug or kikka.ghost.isDebug:
+            self.repaint()
+            return
+
+        rect = dirty_rect.intersected(self._soul_image.rect())
+        if rect.isEmpty():
+            return
+
+        patch = self._get_buffer('_patch_image', rect.size())
+        offset = QPoint() - rect.topLeft()
+        ops = [(self._base_image, offset, 'replace')]
+        for aid, ani in self._animations.items():
+            if ani.get_draw_rect().intersects(rect):
+                ops += ani.get_draw_ops(offset)
+        kikka.helper.draw_images(patch, ops)
+        kikka.helper.draw_images(self._soul_image, [(patch, rect.topLeft(), 'replace')])
+        self._window_shell.update_image(patch, rect)
+
     def repaint(self):
         self.repaint_base_image()
         self.repaint_soul_image()
@@ -401,43 +445,93 @@ class Soul:
                 self._center_point = QPoint(self._size.width() / 2, self._size.height())
         pass
 
-    def repaint_base_image(self):
-        shell_image = self._ghost.get_shell_image()
+    def get_base_image_stats(self):
+        return self._base_images.get_stats()
 
-        self._base_image = QImage(self._size, QImage.Format_ARGB32_Premultiplied)
-        painter = QPainter(self._base_image)
-        painter.setCompositionMode(QPainter.CompositionMode_Source)
-        painter.fillRect(self._base_image.rect(), Qt.transparent)
-        painter.end()
-        del painter
+    def clear_base_images(self):
+        self._base_images.clear()
 
+    def repaint_base_image(self):
         if self._surface is None:
+            self._base_image = self._draw_base_image()
             return
 
-        if len(self._surface.elements) > 0:
+        # size and draw offset only depend on the shell and the surface too
+        key = (self._ghost.get_current_shell().root_path, self._surface.id)
+        self._base_image = self._base_images.get(key, self._draw_base_image)
+
+    def _get_buffer(self, name, size):
+        """an image kept between frames, a new one is only allocated when the size changes"""
+        image = getattr(self, name)
+        if image is None or image.size() != size:
+            image = QImage(size, QImage.Format_ARGB32_Premultiplied)
+            setattr(self, name, image)
+        return image
+
+    def _draw_base_image(self):
+        shell_image = self._ghost.get_shell_image()
+
+        # cached base images are kept by the cache, so it is always a new image
+        base_image = QImage(self._size, QImage.Format_ARGB32_Premultiplied)
+        ops = []
+        if self._surface is None:
+            pass
+        elif len(self._surface.elements) > 0:
             for i, ele in self._surface.elements.items():
                 if ele.filename in shell_image:
-                    offset = self._draw_offset + ele.offset
-                    kikka.helper.draw_image(
-                        self._base_image, shell_image[ele.filename],
-                        offset.x(),
-                        offset.y(),
-                        ele.paint_type
-                    )
+                    ops.append((shell_image[ele.filename], self._draw_offset + ele.offset, ele.paint_type))
         else:
-            img = self.get_shell_image(self._surface.id)
-            painter = QPainter(self._base_image)
-            painter.setCompositionMode(QPainter.CompositionMode_SourceOver)
-            painter.drawImage(self._draw_offset, img)
-            painter.end()
-        # self._base_image.save("_base_image.png")
-        pass
+            ops.append((self.get_shell_image(self._surface.id), self._draw_offset, 'base'))
+        kikka.helper.draw_images(base_image, ops, clear=True)
+        # base_image.save("_base_image.png")
+        return base_image
 
-    def repaint_soul_image(self):
-        self._soul_image = QImage(self._base_image)
+    def _get_dressed_image(self):
+        """the base image with the bind (clothes) animations drawn, None if it can not be reused"""
+        if self._surface is None:
+            return None
+
+        has_bind = False
+        has_frame = False
         for aid, ani in self._animations.items():
-            ani.draw(self._soul_image)
-        pass
+            if ani.is_bind():
+                # a bind layer under a playing animation or bind patterns with side effects must be drawn in order
+                if has_frame or ani.has_control_pattern():
+                    return None
+                has_bind = True
+            elif ani.has_frame():
+                has_frame = True
+
+        if has_bind is False:
+            return None
+
+        def draw_dressed_image():
+            image = QImage(self._base_image.size(), QImage.Format_ARGB32_Premultiplied)
+            ops = [(self._base_image, QPoint(), 'replace')]
+            for _aid, _ani in self._animations.items():
+                if _ani.is_bind():
+                    ops += _ani.get_draw_ops()
+            kikka.helper.draw_images(image, ops)
+            return image
+
+        shell = self._ghost.get_current_shell()
+        key = (shell.root_path, self._surface.id, frozenset(shell.get_bind(self.id)))
+        return self._base_images.get(key, draw_dressed_image)
+
+    def repaint_soul_image(self):
+        dressed_image = self._get_dressed_image()
+        if dressed_image is not None:
+            ops = [(dressed_image, QPoint(), 'replace')]
+            for aid, ani in self._animations.items():
+                if ani.is_bind() is False:
+                    ops += ani.get_draw_ops()
+        else:
+            ops = [(self._base_image, QPoint(), 'replace')]
+            for aid, ani in self._animations.items():
+                ops += ani.get_draw_ops()
+
+        self._soul_image = self._get_buffer('_soul_image', self._base_image.size())
+        kikka.helper.draw_images(self._soul_image, ops)
 
 
 class Animation:
@@ -457,6 +551,7 @@ class Animation:
         self._update_time = 0
         self._current_pattern = -1
         self._last_time = 0
+        self._random_wait = self._get_random_wait()
 
         self._image = None
         self._draw_offset = QPoint()
@@ -501,20 +596,17 @@ class Animation:
                 or self.interval == 'runonce':
             isNeedStart = False
 
-        elif self.interval == 'sometimes':
-            # 20% per second
-            isNeedStart = True if random.random() < 0.0002 * update_time else False
-
-        elif self.interval == 'rarely':
-            # 10% per second
-            isNeedStart = True if random.random() < 0.0001 * update_time else False
-
-        elif self.interval == 'random':
-            # n% per second
-            isNeedStart = True if random.random() < self.interval_value / 100000 * update_time else False
+        elif self.interval in ['sometimes', 'rarely', 'random']:
+            # the wait is drawn in advance, so the core knows when to wake up
+            self._random_wait -= update_time
+            if self._random_wait <= 0:
+                self._random_wait = self._get_random_wait()
+                isNeedStart = True
+            else:
+                isNeedStart = False
 
         elif self.interval == 'periodic':
-            now = time.clock()
+            now = kikka.clock.now()
             if now - self._last_time >= self.interval_value:
                 self._last_time = now
                 isNeedStart = True
@@ -526,6 +618,41 @@ class Animation:
 
         return isNeedStart
 
+    def _get_random_wait(self):
+        """ms until a random animation starts, the same chance as rolling every ms"""
+        if self.interval == 'sometimes':
+            # 20% per second
+            rate = 0.0002
+        elif self.interval == 'rarely':
+            # 10% per second
+            rate = 0.0001
+        elif self.interval == 'random':
+            # n% per second
+            rate = self.interval_value / 100000
+        else:
+            return float('inf')
+        return random.expovariate(rate) if rate > 0 else float('inf')
+
+    def get_next_update_time(self):
+        """ms until this animation needs an update, inf if it only starts by talk, bind or other animations"""
+        if self.is_running is True:
+            if self._current_pattern + 1 < len(self.patterns):
+                return self.patterns[self._current_pattern + 1].time - self._update_time + 1
+            for p in self.patterns.values():
+                if p.is_control_pattern() and p.bind_animation != -1:
+                    # waiting for the started animations to finish
+                    return 0
+        if self.is_finish is False:
+            return float('inf')
+
+        if self.interval in ['sometimes', 'rarely', 'random']:
+            return self._random_wait
+        elif self.interval == 'periodic':
+            return (self.interval_value - (kikka.clock.now() - self._last_time)) * 1000
+        elif self.interval == 'always':
+            return 0
+        return float('inf')
+
     def do_pattern(self, pattern):
         logging.debug("aid:%d %s doPattern %d %s", self.id, self.interval, pattern.id, pattern.method_type)
 
@@ -591,14 +718,43 @@ class Animation:
 
         return is_need_update
 
-    def draw(self, dest_image):
-        if self.id in self._soul.get_ghost().get_current_shell().get_bind(self._soul.id):
+    def is_bind(self):
+        return self.id in self._ghost.get_current_shell().get_bind(self._soul.id)
+
+    def has_frame(self):
+        return self._image is not None
+
+    def has_control_pattern(self):
+        for p in self.patterns.values():
+            if p.is_control_pattern():
+                return True
+        return False
+
+    def get_draw_state(self):
+        return id(self._image), self._draw_offset.x(), self._draw_offset.y(), self._draw_type, self.is_bind()
+
+    def get_draw_rect(self):
+        """the area of the soul image covered by the current frame"""
+        if self.is_bind():
+            rect = QRect(self.rect)
+        elif self._image is not None:
+            rect = QRect(self._draw_offset, self._image.size())
+        else:
+            return QRect()
+        rect.translate(self._soul.get_draw_offset())
+        return rect
+
+    def get_draw_ops(self, offset=QPoint()):
+        """[(image, offset, drawtype)] of the current frame for KikkaHelper.draw_images"""
+        ops = []
+        if self.is_bind():
             for p in self.patterns.values():
                 self.do_pattern(p)
-                offset = self._soul.get_draw_offset() + self._draw_offset
-                kikka.helper.draw_image(dest_image, self._image, offset.x(), offset.y(), self._draw_type)
-        else:
-            offset = self._soul.get_draw_offset() + self._draw_offset
-            kikka.helper.draw_image(dest_image, self._image, offset.x(), offset.y(), self._draw_type)
+                ops.append((self._image, self._soul.get_draw_offset() + self._draw_offset + offset, self._draw_type))
+        elif self._image is not None:
+            ops.append((self._image, self._soul.get_draw_offset() + self._draw_offset + offset, self._draw_type))
+        return ops
 
+    def draw(self, dest_image, offset=QPoint()):
+        kikka.helper.draw_images(dest_image, self.get_draw_ops(offset))
         return dest_image
@@ -1,15 +1,44 @@
 # coding=utf-8
 import logging
 import math
+from array import array
 
 from PyQt5.QtCore import Qt, QRect, QPoint
-from PyQt5.QtGui import QPixmap, QPainter, QColor, QImage, QCursor
+from PyQt5.QtGui import QPixmap, QPainter, QColor, QImage, QCursor, QRegion
 from PyQt5.QtWidgets import QWidget
 
 import kikka
 from kikka.const import GhostEvent
 
 
+class CollisionMap:
+    """A label of every pixel covered by collision boxes, the first box in order wins where they overlap"""
+    def __init__(self, boxes):
+        self.boxes = list(boxes)
+        self._rect = QRect()
+        for rect, tag in self.boxes:
+            self._rect = self._rect.united(rect)
+
+        # 0 is outside all boxes, box i is labelled i + 1
+        self._width = self._rect.width()
+        self._labels = array('H', bytes(2 * self._width * self._rect.height()))
+        for i in range(len(self.boxes) - 1, -1, -1):
+            rect = self.boxes[i][0].translated(-self._rect.topLeft())
+            row = array('H', [i + 1]) * rect.width()
+            for y in range(rect.top(), rect.bottom() + 1):
+                start = y * self._width + rect.left()
+                self._labels[start:start + rect.width()] = row
+
+    def get_box(self, x, y):
+        """(rect, tag) of the box at the point, None outside all boxes"""
+        x -= self._rect.left()
+        y -= self._rect.top()
+        if x < 0 or y < 0 or x >= self._width or y >= self._rect.height():
+            return None
+        label = self._labels[y * self._width + x]
+        return self.boxes[label - 1] if label > 0 else None
+
+
 class WindowShell(QWidget):
     def __init__(self, soul, win_id):
         QWidget.__init__(self)
@@ -20,6 +49,9 @@ class WindowShell(QWidget):
         self._is_moving = False
         self._offset = QPoint(0, 0)
         self._boxes = {}
+        self._collision_map = CollisionMap([])
+        self._move_tag = None
+        self._is_mouse_in = False
         self._move_pos = QPoint(0, 0)
         self._mouse_pos = QPoint(0, 0)
         self._pix_map = None
@@ -41,50 +73,53 @@ class WindowShell(QWidget):
         self._boxes = {}
         self._offset = offset
         for cid, col in boxes.items():
-            rect = col.rect
-            rect.moveTopLeft(col.rect.topLeft() + offset)
+            rect = col.rect.normalized().translated(offset)
+            if rect.isEmpty():
+                continue
             self._boxes[cid] = (rect, col.tag)
+        self._collision_map = CollisionMap(self._boxes.values())
 
     def _box_collision(self, event_type, event):
         if self._is_moving is True:
             return
 
-        mx = self._mouse_pos.x()
-        my = self._mouse_pos.y()
-        for cid, box in self._boxes.items():
-            rect = box[0]
-            if rect.contains(mx, my) is False:
-                continue
+        box = self._collision_map.get_box(self._mouse_pos.x(), self._mouse_pos.y())
+        tag = box[1] if box is not None else None
 
-            tag = box[1]
-            param = kikka.helper.make_ghost_event_param(self._ghost.id, self._soul.id, event_type, tag)
+        # moving inside the same box only counts towards a touch
+        if event_type != GhostEvent.Shell_MouseMove or tag != self._move_tag or self._is_mouse_in is False:
+            param = kikka.helper.make_ghost_event_param(
+                self._ghost.id, self._soul.id, event_type, tag if tag is not None else 'None')
             param.data['ShellWindowID'] = self.id
             param.data['QEvent'] = event
             self._ghost.emit_ghost_event(param)
+        if event_type == GhostEvent.Shell_MouseMove:
+            self._move_tag = tag
+            self._is_mouse_in = True
 
-            # Touch
-            if self._touch_type == event_type and self._touch_place == tag:
-                self._touch_tick += 1
-            else:
-                self._touch_tick = 1
-                self._touch_type = event_type
-                self._touch_place = tag
-
-            touch_area = rect.width() * rect.height()
-            request_tick = max(30.0, math.sqrt(touch_area))
-            # print(self._touchTick, request_tick)
-            if self._touch_tick > request_tick:
-                self._touch_tick = 0
-                param.event_type = GhostEvent.Shell_MouseTouch
-                param.event_tag = tag
-                self._ghost.emit_ghost_event(param)
-            return tag
-
-        param = kikka.helper.make_ghost_event_param(self._ghost.id, self._soul.id, event_type, 'None')
-        param.data['ShellWindowID'] = self.id
-        param.data['QEvent'] = event
-        self._ghost.emit_ghost_event(param)
-        return None
+        if box is None:
+            return None
+
+        # Touch
+        if self._touch_type == event_type and self._touch_place == tag:
+            self._touch_tick += 1
+        else:
+            self._touch_tick = 1
+            self._touch_type = event_type
+            self._touch_place = tag
+
+        rect = box[0]
+        touch_area = rect.width() * rect.height()
+        request_tick = max(30.0, math.sqrt(touch_area))
+        # print(self._touchTick, request_tick)
+        if self._touch_tick > request_tick:
+            self._touch_tick = 0
+            param = kikka.helper.make_ghost_event_param(
+                self._ghost.id, self._soul.id, GhostEvent.Shell_MouseTouch, tag)
+            param.data['ShellWindowID'] = self.id
+            param.data['QEvent'] = event
+            self._ghost.emit_ghost_event(param)
+        return tag
 
     def _mouse_logging(self, event, button, x, y):
         if kikka.core.isDebug:
@@ -135,6 +170,17 @@ class WindowShell(QWidget):
             line = drawText(painter, line, left, "surface: %d" % self._soul.get_current_surface_id())
             line = drawText(painter, line, left, "bind: %s" % shell.get_bind(self._soul.id))
             line = drawText(painter, line, left, "animations: %s" % self._soul.get_running_animation())
+            stats = self._ghost.get_shell_image().get_stats()
+            line = drawText(painter, line, left, "shell image: %d/%d %.1fMB" % (
+                stats['decoded'], stats['total'], stats['bytes'] / 1024 / 1024))
+            stats = kikka.image_cache.get_stats()
+            line = drawText(painter, line, left, "image cache: %.1fMB hit %d miss %d evict %d" % (
+                stats['bytes'] / 1024 / 1024, stats['hits'], stats['misses'], stats['evictions']))
+            stats = self._soul.get_base_image_stats()
+            line = drawText(painter, line, left, "base image: %d %.1fMB hit %d miss %d" % (
+                stats['count'], stats['bytes'] / 1024 / 1024, stats['hits'], stats['misses']))
+            line = drawText(painter, line, left, "tick: %d/s skipped %d" % (
+                kikka.core.get_tick_rate(), kikka.core.get_skipped_ticks()))
             line = drawText(painter, line, left, "shell offset: %d %d" % (shell_offset.x(), shell_offset.y()), Qt.green)
             line = drawText(painter, line, left, "draw offset: %d %d" % (draw_offset.x(), draw_offset.y()), Qt.blue)
             line = drawText(painter, line, left, "surface center: %d %d" % (center_pos.x(), center_pos.y()), Qt.red)
@@ -151,8 +197,7 @@ class WindowShell(QWidget):
             if surface is not None:
                 for cid, col in surface.collision_boxes.items():
                     painter.setPen(Qt.red)
-                    rect = col.rect
-                    rect.moveTopLeft(col.rect.topLeft() + draw_offset)
+                    rect = col.rect.translated(draw_offset)
                     painter.drawRect(rect)
                     painter.fillRect(rect, QColor(255, 255, 255, 64))
                     painter.setPen(Qt.black)
@@ -171,6 +216,22 @@ class WindowShell(QWidget):
         self.setMask(self._pix_map.mask())
         self.repaint()
 
+    def update_image(self, image, rect):
+        """replace the rect area of the shown image, only that area is repainted"""
+        if self._pix_map is None:
+            return
+
+        pix_map = QPixmap().fromImage(image, Qt.AutoColor)
+        painter = QPainter(self._pix_map)
+        painter.setCompositionMode(QPainter.CompositionMode_Source)
+        painter.drawPixmap(rect.topLeft(), pix_map)
+        painter.end()
+
+        mask = pix_map.mask()
+        region = QRegion(rect) if mask.isNull() else QRegion(mask).translated(rect.topLeft())
+        self.setMask(self.mask().subtracted(QRegion(rect)).united(region))
+        self.update(rect)
+
     # ##############################################################################################################
     # Event
 
@@ -225,11 +286,16 @@ class WindowShell(QWidget):
 
         tag = self._box_collision(GhostEvent.Shell_MouseMove, event)
         if tag == 'Bust':
-            self.setCursor(QCursor(Qt.OpenHandCursor))
+            cursor = Qt.OpenHandCursor
         elif tag is None:
-            self.setCursor(QCursor(Qt.ArrowCursor))
+            cursor = Qt.ArrowCursor
         else:
-            self.setCursor(QCursor(Qt.PointingHandCursor))
+            cursor = Qt.PointingHandCursor
+        if self.cursor().shape() != cursor:
+            self.setCursor(QCursor(cursor))
+
+    def leaveEvent(self, event):
+        self._is_mouse_in = False
 
     def mouseReleaseEvent(self, event):
         self._mouse_logging("mouseReleaseEvent", event.buttons(), event.globalPos().x(), event.globalPos().y())
@@ -292,4 +358,4 @@ class WindowShell(QWidget):
         if self._pix_map is None:
             return
         painter = QPainter(self)
-        painter.drawPixmap(QPoint(), self._pix_map)
+        painter.drawPixmap(event.rect(), self._pix_map, event.rect())
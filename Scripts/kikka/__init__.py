@@ -4,7 +4,9 @@ import kikka.path
 import kikka.fileloader
 
 from kikka.helper import KikkaHelper as helper
+from kikka.clock import KikkaClock as clock
 from kikka.memory import KikkaMemory as memory
+from kikka.image_cache import KikkaImageCache as image_cache
 from kikka.app import KikkaApp as app
 from kikka.menu import KikkaMenu as menu
 from ghost.kikka_ghost import KikkaGhost as ghost
@@ -13,7 +15,9 @@ from kikka.core import KikkaCore as core
 const = kikka.const
 path = kikka.path
 helper = helper()
+clock = clock()
 memory = memory()
+image_cache = image_cache()
 app = app()
 menu = menu()
 ghost = ghost()
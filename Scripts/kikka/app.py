@@ -26,7 +26,8 @@ class KikkaApp(Singleton):
 
         logging.info("")
         logging.info("Hey~ Kikka here %s" % ("-" * 40))
-        kikka.memory.awake(kikka.const.KikkaMemoryFileName)
+        # KIKKA_MEMORY points test and benchmark runs to their own memory file
+        kikka.memory.awake(os.environ.get('KIKKA_MEMORY', kikka.const.KikkaMemoryFileName))
 
     def _load(self):
         time.sleep(1)
@@ -64,6 +65,7 @@ class KikkaApp(Singleton):
         app = QApplication.instance()
         app.exit(0)
 
+        # close() saves the writes still waiting in the memory
         kikka.memory.close()
         logging.info("Bye Bye~")
 
@@ -0,0 +1,56 @@
+# coding=utf-8
+import time
+import datetime
+
+from kikka.helper import Singleton
+
+if hasattr(time, 'perf_counter_ns'):
+    _perf_counter_ns = time.perf_counter_ns
+else:
+    def _perf_counter_ns():
+        return int(time.perf_counter() * 1000000000)
+
+
+class KikkaClock(Singleton):
+    """Monotonic clock read by the core loop, talks and animations
+
+    A virtual clock only moves by advance(), so timing can be run faster than real time.
+    wall_time() moves with it, so minute and hour events are replayed too.
+    """
+    isDebug = False
+
+    def __init__(self):
+        self._virtual_ns = None
+        self._wall_start = None
+
+    def now_ns(self):
+        return self._virtual_ns if self._virtual_ns is not None else _perf_counter_ns()
+
+    def now(self):
+        """seconds"""
+        return self.now_ns() / 1000000000
+
+    def now_ms(self):
+        return self.now_ns() / 1000000
+
+    def wall_time(self):
+        """datetime of now, the local time for the real clock"""
+        if self._virtual_ns is None:
+            return datetime.datetime.now()
+        return self._wall_start + datetime.timedelta(microseconds=self._virtual_ns // 1000)
+
+    def use_virtual_clock(self, start_ms=0, wall_start=None):
+        """wall_start is the datetime at virtual time 0, the local time by default"""
+        self._virtual_ns = int(start_ms * 1000000)
+        self._wall_start = wall_start if wall_start is not None else datetime.datetime.now()
+
+    def use_real_clock(self):
+        self._virtual_ns = None
+
+    def is_virtual(self):
+        return self._virtual_ns is not None
+
+    def advance(self, ms):
+        if self._virtual_ns is None:
+            raise RuntimeError("advance: only a virtual clock can be advanced")
+        self._virtual_ns += int(ms * 1000000)
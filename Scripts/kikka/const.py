@@ -3,6 +3,13 @@ from enum import Enum
 from PyQt5.QtCore import QPoint, QSize
 
 KikkaMemoryFileName = 'Kikka.memory'
+MemoryWriteDelay = 1000  # ms, repeated writes to a memory key within this time are saved once
+ImageCacheSize = 256 * 1024 * 1024  # bytes of decoded images shared by all shells
+BaseImageCacheSize = 32 * 1024 * 1024  # bytes of composited surfaces kept by each soul
+CoreMaxTimerInterval = 1000  # ms, the longest the core sleeps when nothing is due
+CoreUpdateTimeHistory = 1000  # on_update times kept per ghost for the tick report
+ScanThreadCount = 8  # threads reading ghost/shell/balloon descriptors, 1 to scan serially
+ShellAlphaConvert = True  # apply .pna masks and the top-left colour key of shell images when decoding
 IMAGE_FORMATS = [
     '.bmp', '.png', '.jpg', '.jpeg', '.gif',
     '.pbm', '.pgm', '.ppm',  # Portable Bit Map
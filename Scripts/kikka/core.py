@@ -2,8 +2,8 @@
 import time
 import random
 import logging
-import datetime
 from enum import Enum
+from collections import deque
 
 from PyQt5.QtCore import QTimer, QObject, pyqtSignal
 
@@ -28,7 +28,7 @@ class KikkaCore(Singleton):
 
     def __init__(self):
         self._app_state = KikkaCore.APP_STATE.SHOW
-        self._last_clock = time.clock()
+        self._last_clock = kikka.clock.now()
         self._is_need_update = True
         self._ghosts = {}
 
@@ -40,8 +40,14 @@ class KikkaCore(Singleton):
 
         kikka.memory.create_table("kikka_core")
         self._run_timer = QTimer()
-        self._run_timer.setSingleShot(False)
+        self._run_timer.setSingleShot(True)
+        self._run_timer.timeout.connect(self.run)
         self._timer_interval = 10
+        self._max_timer_interval = kikka.const.CoreMaxTimerInterval
+        self._is_running = False
+        self._tick_clocks = deque()
+        self._skipped_ticks = 0
+        self._update_times = {}
         self.set_timer_interval(self._timer_interval)
 
     def set_state(self, state):
@@ -103,40 +109,113 @@ class KikkaCore(Singleton):
             self._ghosts[ghost_id].set_shell(shell_id)
 
     def start(self):
-        self._last_clock = time.clock()
-        self._run_timer.timeout.connect(self.run)
+        # show() and screen_client_size_change() start again while running, only the first start resets the clock
+        if self._run_timer.isActive():
+            return
+        self._last_clock = kikka.clock.now()
         self._run_timer.start(self._timer_interval)
 
+    def is_started(self):
+        return self._run_timer.isActive()
+
     def stop(self):
         self._run_timer.stop()
 
+    def wake(self):
+        """run at once instead of waiting for the next scheduled event, e.g. on input or a new talk"""
+        if self._is_running is False and self._run_timer.isActive() and self._run_timer.remainingTime() > 0:
+            self._run_timer.start(0)
+
     def set_timer_interval(self, interval):
+        """the shortest time between two runs"""
         self._timer_interval = interval
         self._run_timer.setInterval(interval)
 
     def get_timer_interval(self):
         return self._timer_interval
 
+    def get_next_update_time(self):
+        """ms until the next ghost event is due, clamped between the timer interval and the max interval"""
+        next_time = self._max_timer_interval
+        for gid, ghost in self._ghosts.items():
+            next_time = min(next_time, ghost.get_next_update_time())
+        return int(max(self._timer_interval, next_time))
+
+    def get_tick_rate(self):
+        """runs in the last second"""
+        return len(self._tick_clocks)
+
+    def get_skipped_ticks(self):
+        """fixed interval ticks saved by sleeping until the next event"""
+        return self._skipped_ticks
+
+    def _record_update_time(self, ghost_id, ms):
+        if ghost_id not in self._update_times:
+            self._update_times[ghost_id] = deque(maxlen=kikka.const.CoreUpdateTimeHistory)
+        self._update_times[ghost_id].append(ms)
+
+    @staticmethod
+    def _percentile(sorted_values, percent):
+        index = int(round((len(sorted_values) - 1) * percent / 100.0))
+        return sorted_values[index]
+
+    def get_update_time_report(self):
+        """{ghost_id: {'name', 'count', 'p50', 'p95', 'max'}} of the recent on_update times in ms"""
+        report = {}
+        for gid, times in self._update_times.items():
+            if len(times) == 0:
+                continue
+            values = sorted(times)
+            report[gid] = {
+                'name': self._ghosts[gid].name if gid in self._ghosts else '',
+                'count': len(values),
+                'p50': self._percentile(values, 50),
+                'p95': self._percentile(values, 95),
+                'max': values[-1],
+            }
+        return report
+
+    def dump_update_time_report(self):
+        logging.info("core tick: %d/s, skipped %d, interval %d ms",
+                     self.get_tick_rate(), self.get_skipped_ticks(), self._timer_interval)
+        for gid, item in self.get_update_time_report().items():
+            logging.info("ghost %d %s on_update: count %d p50 %.2f ms p95 %.2f ms max %.2f ms",
+                         gid, item['name'], item['count'], item['p50'], item['p95'], item['max'])
+
     def run(self):
+        self._is_running = True
         try:
-            now_clock = time.clock()
+            now_clock = kikka.clock.now()
             update_time = (now_clock - self._last_clock) * 1000
 
             for gid, ghost in self._ghosts.items():
+                start = time.perf_counter()
                 ghost.on_update(update_time)
+                self._record_update_time(gid, (time.perf_counter() - start) * 1000)
 
             self._last_clock = now_clock
         except Exception:
             logging.exception('Core.run: run time error')
             raise SyntaxError('run time error')
+        finally:
+            self._is_running = False
         self._is_need_update = False
 
+        self._tick_clocks.append(now_clock)
+        while now_clock - self._tick_clocks[0] > 1.0:
+            self._tick_clocks.popleft()
+
+        if self._app_state == KikkaCore.APP_STATE.SHOW:
+            next_time = self.get_next_update_time()
+            self._skipped_ticks += next_time // self._timer_interval - 1
+            self._run_timer.start(next_time)
+
     def repaint_all_ghost(self):
         for _, g in self._ghosts.items():
             g.repaint()
 
     def get_property(self, key):
-        now = datetime.datetime.now()
+        now = kikka.clock.wall_time()
         if key == '':
             return None
         elif key == 'system.year':
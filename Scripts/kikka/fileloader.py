@@ -1,96 +1,416 @@
 
 import os
+import mmap
+import zlib
+import struct
 import logging
 import zipfile
+import threading
 
-from PyQt5.QtGui import QImage
+from PyQt5.QtCore import Qt, QByteArray
+from PyQt5.QtGui import QImage, QPainter
 
 import kikka
 
 
 class FileLoader:
+    # images of ukagaka shells take their alpha from a .pna mask or the colour of the top-left pixel
+    is_alpha_convert = False
+    ALPHA_CONVERT_EXCLUDE = ['background', 'foreground', 'sidebar']
+
     def __init__(self, root_path):
         self.root_path = root_path
         self.is_zip = False
         self.is_initialized = False
+        self.is_indexed = False
 
-        self.namelist = []
-        self.image_list = []
+        self._namelist = []
+        self._image_list = []
+        self._index = {}  # normalized relative path -> ZipInfo of a zip member or path of a file
 
         self._zipfile = None
+        self._zipmap = None
+        self._index_lock = threading.Lock()
         self._init()
 
+    @property
+    def namelist(self):
+        self.build_index()
+        return self._namelist
+
+    @property
+    def image_list(self):
+        self.build_index()
+        return self._image_list
+
+    @staticmethod
+    def normalize(filename):
+        """the key of a file in the index: lower case, '/' separated"""
+        filename = filename.replace('\\', '/').lower()
+        while filename.startswith('./'):
+            filename = filename[2:]
+        return filename.lstrip('/')
+
     def _init(self):
+        # only check the root here, the file index is built on first use, see build_index()
         if os.path.isfile(self.root_path) and zipfile.is_zipfile(self.root_path):
-            self.is_initialized = self._init_from_zip()
+            self._zipfile = zipfile.ZipFile(self.root_path, 'r')
+            self._zipmap = ZipMap.open(self.root_path)
+            self.is_zip = True
+            self.is_initialized = True
         elif os.path.isdir(self.root_path) and os.path.exists(self.root_path):
-            self.is_initialized = self._init_from_dir()
+            self.is_initialized = True
         else:
             self.is_initialized = False
 
+    def build_index(self):
+        if self.is_indexed:
+            return
+
+        with self._index_lock:
+            if self.is_indexed or not self.is_initialized:
+                return
+            if self.is_zip:
+                self._init_from_zip()
+            else:
+                self._init_from_dir()
+            self.is_indexed = True
+
+    def _add_to_index(self, filename, entry):
+        self._namelist.append(filename)
+        self._index[self.normalize(filename)] = entry
+        name, ext = os.path.splitext(filename)
+        if ext.lower() in kikka.const.IMAGE_FORMATS:
+            self._image_list.append(filename)
+
     def _init_from_dir(self):
         for parent, dir_names, file_names in os.walk(self.root_path):
             rel = '' if parent == self.root_path else os.path.relpath(parent, self.root_path)
             for file_name in file_names:
-                file = os.path.join(rel, file_name)
-                self.namelist.append(file)
-                name, ext = os.path.splitext(file_name)
-                if ext in kikka.const.IMAGE_FORMATS:
-                    self.image_list.append(file)
+                self._add_to_index(os.path.join(rel, file_name), os.path.join(parent, file_name))
         return True
 
     def _init_from_zip(self):
-        self._zipfile = zipfile.ZipFile(self.root_path, 'r')
-        self.is_zip = True
-
+        # members may be packed under a folder named like the zip
         name, ext = os.path.splitext(os.path.basename(self.root_path))
-        self.namelist = [file.replace(name + '/', '').replace('/', '\\') for file in self._zipfile.namelist()]
-        if '' in self.namelist:
-            self.namelist.remove('')
-
-        for filename in self.namelist:
-            name, ext = os.path.splitext(filename)
-            if ext in kikka.const.IMAGE_FORMATS:
-                self.image_list.append(filename)
+        prefix = name + '/'
+        for info in self._zipfile.infolist():
+            if info.is_dir():
+                continue
+            filename = info.filename[len(prefix):] if info.filename.startswith(prefix) else info.filename
+            self._add_to_index(filename.replace('/', '\\'), info)
         return True
 
-    def get_fp(self, filename, mode, encoding='utf-8'):
+    def _get_rel_path(self, filename):
         if filename.startswith(self.root_path):
             filename = os.path.relpath(filename, self.root_path)
+        return filename
 
-        if filename not in self.namelist:
+    def _find(self, filename):
+        """the ZipInfo or the file path of filename, None if the file does not exist"""
+        filename = self._get_rel_path(filename)
+
+        # descriptors are read before the index exists, they are answered without listing all files
+        if not self.is_indexed:
+            return self._find_in_zip(filename) if self.is_zip else self._find_in_dir(filename)
+
+        self.build_index()
+        return self._index.get(self.normalize(filename), None)
+
+    def _find_in_dir(self, filename):
+        path = os.path.join(self.root_path, filename.replace('\\', os.sep))
+        if os.path.isfile(path):
+            return path
+
+        parent, base = os.path.split(path)
+        if not os.path.isdir(parent):
             return None
+        base = base.lower()
+        for name in os.listdir(parent):
+            if name.lower() == base and os.path.isfile(os.path.join(parent, name)):
+                return os.path.join(parent, name)
+        return None
 
-        if self.is_zip:
-            name, ext = os.path.splitext(os.path.basename(self.root_path))
-            filename = os.path.join(name, filename)
-            filename = filename.replace('\\', '/')
+    def _find_in_zip(self, filename):
+        if self._zipfile is None:
+            return None
+        name, ext = os.path.splitext(os.path.basename(self.root_path))
+        filename = filename.replace('\\', '/').lstrip('/')
+        for member in [filename, name + '/' + filename]:
+            try:
+                return self._zipfile.getinfo(member)
+            except KeyError:
+                pass
+
+        key = self.normalize(filename)
+        prefix = self.normalize(name + '/')
+        for info in self._zipfile.infolist():
+            member = self.normalize(info.filename)
+            if not info.is_dir() and (member == key or member == prefix + key):
+                return info
+        return None
+
+    def has_file(self, filename):
+        return self._find(filename) is not None
 
+    def get_fp(self, filename, mode, encoding='utf-8'):
+        entry = self._find(filename)
+        if entry is None:
+            return None
+
+        if self.is_zip:
             if 'b' in mode:
                 mode = mode.replace('b', '')
 
             if mode not in ['r', 'w']:
                 return None
 
-            fp = self._zipfile.open(filename, mode)
+            fp = self._zipfile.open(entry, mode)
         else:
-            filename = os.path.join(self.root_path, filename)
             if 'b' in mode:
-                fp = open(filename, mode)
+                fp = open(entry, mode)
             else:
-                fp = open(filename, mode, encoding=encoding)
+                fp = open(entry, mode, encoding=encoding)
         return fp
 
+    def get_data(self, filename):
+        """the content of a file, stored zip members are returned as a memoryview of the mapped archive"""
+        entry = self._find(filename)
+        if entry is None:
+            return None
+
+        if self.is_zip:
+            try:
+                data = self._zipmap.read(entry) if self._zipmap is not None else None
+                if data is None:
+                    with self._zipfile.open(entry, 'r') as fp:
+                        data = fp.read()
+            except (zipfile.BadZipFile, zlib.error) as e:
+                logging.warning("FileLoader: read %s in %s fail: %s", entry.filename, self.root_path, e)
+                return None
+        else:
+            with open(entry, 'rb') as fp:
+                data = fp.read()
+        return data
+
+    def close(self):
+        if self._zipmap is not None:
+            self._zipmap.close()
+            self._zipmap = None
+        if self._zipfile is not None:
+            self._zipfile.close()
+            self._zipfile = None
+
+    def get_file_stamp(self, filename):
+        """the CRC of a zip member or the mtime of a file, None if the file does not exist"""
+        entry = self._find(filename)
+        if entry is None:
+            return None
+
+        if self.is_zip:
+            return entry.CRC
+        else:
+            return os.stat(entry).st_mtime_ns
+
+    def get_image_key(self, filename):
+        filename = self.normalize(self._get_rel_path(filename))
+        stamp = self.get_file_stamp(filename)
+        if stamp is None:
+            return None
+        if self._is_alpha_convert(filename):
+            return self.root_path, filename, stamp, self.get_file_stamp(self._get_pna_name(filename))
+        return self.root_path, filename, stamp
+
     def get_image(self, filename):
-        fp = self.get_fp(filename, 'rb')
-        if fp:
-            data = fp.read()
-            img = QImage.fromData(data)
-            if img:
-                return img
+        key = self.get_image_key(filename)
+        img = kikka.image_cache.get(key, lambda: self._decode_image(filename)) if key is not None else None
+        if img is not None:
+            return img
 
         logging.warning("Image lost: %s" % filename)
         return kikka.helper.get_default_image()
 
+    def _is_alpha_convert(self, filename):
+        if self.is_alpha_convert is False or kikka.const.ShellAlphaConvert is False:
+            return False
+        name, ext = os.path.splitext(os.path.basename(filename.replace('\\', '/')))
+        return ext.lower() == '.png' and name.lower() not in self.ALPHA_CONVERT_EXCLUDE
+
+    @staticmethod
+    def _get_pna_name(filename):
+        return os.path.splitext(filename)[0] + '.pna'
+
+    def _decode_image(self, filename):
+        img = self._decode_data(self.get_data(filename))
+        if img is not None and self._is_alpha_convert(filename):
+            img = self._convert_alpha(filename, img)
+        return img
+
+    @staticmethod
+    def _decode_data(data):
+        if data is None:
+            return None
+
+        if isinstance(data, memoryview):
+            # wrap the mapped bytes without copying, the view is released once the image is decoded
+            img = QImage.fromData(QByteArray.fromRawData(data))
+            data.release()
+        else:
+            img = QImage.fromData(data)
+        return img if not img.isNull() else None
+
+    def _convert_alpha(self, filename, img):
+        """the image with the alpha of its .pna mask, or with the colour of the top-left pixel made transparent"""
+        pna = self._decode_data(self.get_data(self._get_pna_name(filename)))
+        if pna is not None and pna.size() != img.size():
+            logging.warning("pna size not match: %s", filename)
+            pna = None
+
+        if pna is not None:
+            img = img.convertToFormat(QImage.Format_ARGB32)
+            img.setAlphaChannel(pna.convertToFormat(QImage.Format_Grayscale8))
+            return img
+
+        color = img.pixel(0, 0)
+        if img.hasAlphaChannel() and (color >> 24) == 0:
+            return img
+
+        img = img.convertToFormat(QImage.Format_ARGB32)
+        mask = img.createMaskFromColor(img.pixel(0, 0), Qt.MaskOutColor)
+        mask.setColorTable([0x00000000, 0xff000000])
+        painter = QPainter(img)
+        painter.setCompositionMode(QPainter.CompositionMode_DestinationIn)
+        painter.drawImage(0, 0, mask)
+        painter.end()
+        return img
+
+
+class ZipMap:
+    """Read zip members from a memory-mapped archive, the central directory is still parsed by zipfile"""
+    LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+    LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, fp, map):
+        self._fp = fp
+        self._map = map
+
+    @staticmethod
+    def open(path):
+        try:
+            fp = open(path, 'rb')
+        except OSError as e:
+            logging.warning("ZipMap: open %s fail: %s", path, e)
+            return None
+
+        try:
+            return ZipMap(fp, mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ))
+        except (OSError, ValueError) as e:
+            logging.warning("ZipMap: mmap %s fail: %s", path, e)
+            fp.close()
+            return None
+
+    def _get_data_range(self, info):
+        start = info.header_offset
+        header = self.LOCAL_HEADER.unpack_from(self._map, start)
+        if header[0] != self.LOCAL_HEADER_SIGNATURE:
+            return None
+        start += self.LOCAL_HEADER.size + header[9] + header[10]
+        return start, start + info.compress_size
+
+    def read(self, info):
+        """a memoryview for stored members, a bytearray for deflated ones, None if it should be read by zipfile
+
+        raise zipfile.BadZipFile when the data does not match the size or CRC of the member
+        """
+        if self._map is None or info.flag_bits & 0x1:
+            return None
+
+        data_range = self._get_data_range(info)
+        if data_range is None:
+            return None
+        start, end = data_range
+
+        if info.compress_type == zipfile.ZIP_STORED:
+            data = memoryview(self._map)[start:end]
+            if len(data) != info.file_size or zlib.crc32(data) != info.CRC:
+                data.release()
+                raise zipfile.BadZipFile("Bad CRC-32 for file %r" % info.filename)
+            return data
+
+        if info.compress_type == zipfile.ZIP_DEFLATED:
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            data = bytearray(info.file_size)
+            size = 0
+            crc = 0
+            with memoryview(self._map) as view, memoryview(data) as out:
+                for pos in range(start, end + self.CHUNK_SIZE, self.CHUNK_SIZE):
+                    if pos < end:
+                        # never inflate past the declared size, a bad member can not grow the buffer
+                        chunk = decompressor.decompress(view[pos:min(pos + self.CHUNK_SIZE, end)],
+                                                        info.file_size - size + 1)
+                    else:
+                        chunk = decompressor.flush()
+                    if size + len(chunk) > info.file_size:
+                        raise zipfile.BadZipFile("File %r is larger than its size" % info.filename)
+                    out[size:size + len(chunk)] = chunk
+                    size += len(chunk)
+                    crc = zlib.crc32(chunk, crc)
+            if size != info.file_size or crc != info.CRC:
+                raise zipfile.BadZipFile("Bad CRC-32 for file %r" % info.filename)
+            return data
+        return None
+
+    def close(self):
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # a memoryview is still alive, let the garbage collector unmap it
+                pass
+            self._map = None
+        self._fp.close()
+
+
+class ImageStore:
+    """Decode images of a FileLoader on first access, used like a read-only dict"""
+    def __init__(self, file_loader):
+        self._loader = file_loader
+        self._names = {FileLoader.normalize(filename): filename for filename in file_loader.image_list}
+        self._images = {}
+
+    def __contains__(self, filename):
+        return FileLoader.normalize(filename) in self._names
+
+    def __getitem__(self, filename):
+        key = FileLoader.normalize(filename)
+        if key not in self._images:
+            if key not in self._names:
+                raise KeyError(filename)
+            self._images[key] = self._loader.get_image(self._names[key])
+        return self._images[key]
+
+    def __len__(self):
+        return len(self._names)
+
+    def __iter__(self):
+        return iter(self._names.values())
+
+    def get(self, filename, default=None):
+        return self[filename] if filename in self else default
+
+    def keys(self):
+        return set(self._names.values())
+
+    def get_decoded_count(self):
+        return len(self._images)
 
+    def get_decoded_bytes(self):
+        return sum(kikka.image_cache.get_image_bytes(img) for img in self._images.values())
 
+    def get_stats(self):
+        return {
+            'total': len(self._names),
+            'decoded': self.get_decoded_count(),
+            'bytes': self.get_decoded_bytes(),
+        }
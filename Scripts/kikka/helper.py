@@ -6,7 +6,7 @@ import copy
 import hashlib
 import logging
 
-from PyQt5.QtCore import QPoint
+from PyQt5.QtCore import Qt, QPoint
 from PyQt5.QtGui import QImage, QPainter
 from PyQt5.QtWidgets import QApplication
 
@@ -102,10 +102,7 @@ class KikkaHelper(Singleton):
             return QImage(self._default_image)
 
     @staticmethod
-    def draw_image(destImage, srcImage, x, y, drawtype):
-        if destImage is None or srcImage is None:
-            return
-
+    def get_composition_mode(drawtype):
         if drawtype == 'base' or drawtype == 'overlay':
             mode = QPainter.CompositionMode_SourceOver
         elif drawtype == 'overlayfast':
@@ -118,10 +115,34 @@ class KikkaHelper(Singleton):
             mode = QPainter.CompositionMode_DestinationAtop
         else:
             mode = QPainter.CompositionMode_SourceOver
+        return mode
+
+    @staticmethod
+    def draw_image(destImage, srcImage, x, y, drawtype):
+        if destImage is None or srcImage is None:
+            return
+        KikkaHelper.draw_images(destImage, [(srcImage, QPoint(x, y), drawtype)])
 
-        painter = QPainter(destImage)
+    @staticmethod
+    def draw_images(dest_image, ops, clear=False):
+        """draw [(image, offset, drawtype)] in order with one painter, clear fills dest_image with transparent first"""
+        if dest_image is None:
+            return
+
+        painter = QPainter(dest_image)
+        mode = QPainter.CompositionMode_Source
         painter.setCompositionMode(mode)
-        painter.drawImage(QPoint(x, y), srcImage)
+        if clear is True:
+            painter.fillRect(dest_image.rect(), Qt.transparent)
+
+        for image, offset, drawtype in ops:
+            if image is None:
+                continue
+            op_mode = KikkaHelper.get_composition_mode(drawtype)
+            if op_mode != mode:
+                mode = op_mode
+                painter.setCompositionMode(mode)
+            painter.drawImage(offset, image)
         painter.end()
 
     @staticmethod
@@ -0,0 +1,85 @@
+# coding=utf-8
+import logging
+import threading
+from collections import OrderedDict
+
+import kikka
+from kikka.helper import Singleton
+
+
+class ImageCache:
+    """LRU cache of QImages bounded by the bytes of the decoded pixels"""
+    def __init__(self, max_bytes):
+        self._images = OrderedDict()
+        self._lock = threading.RLock()
+        self._bytes = 0
+        self._max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def get_image_bytes(image):
+        return image.bytesPerLine() * image.height()
+
+    def set_max_bytes(self, max_bytes):
+        with self._lock:
+            self._max_bytes = max_bytes
+            self._evict()
+
+    def get_max_bytes(self):
+        return self._max_bytes
+
+    def get(self, key, load_func):
+        with self._lock:
+            if key in self._images:
+                self._images.move_to_end(key)
+                self.hits += 1
+                return self._images[key]
+            self.misses += 1
+
+        image = load_func()
+        if image is None:
+            return None
+
+        with self._lock:
+            if key not in self._images:
+                self._images[key] = image
+                self._bytes += self.get_image_bytes(image)
+                self._evict()
+        return image
+
+    def _evict(self):
+        while self._bytes > self._max_bytes and len(self._images) > 1:
+            key, image = self._images.popitem(last=False)
+            self._bytes -= self.get_image_bytes(image)
+            self.evictions += 1
+            logging.debug("image cache evict: %s", key)
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+            self._bytes = 0
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'count': len(self._images),
+                'bytes': self._bytes,
+                'max_bytes': self._max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+class KikkaImageCache(Singleton, ImageCache):
+    """decoded shell and balloon images shared by all ghosts
+
+    key: (root_path, filename, stamp), stamp is the mtime of a file or the CRC of a zip member
+    """
+    isDebug = False
+
+    def __init__(self):
+        ImageCache.__init__(self, kikka.const.ImageCacheSize)
@@ -1,66 +1,193 @@
 # coding=utf-8
+import copy
 import json
 import time
-import uuid
+import pickle
 import queue
 import logging
 import sqlite3
 import threading
+from concurrent.futures import Future
+
+import kikka
 from kikka.helper import Singleton
 
 
+class LegacyText(str):
+    """a value saved as text before the type column existed, read() converts it by the type of the default"""
+    pass
+
+
 class KikkaMemory(Singleton):
     isDebug = False
+    VERSION = 2  # PRAGMA user_version of the memory file
+    TABLE = 'KIKKA_MEMORY'
+    PRAGMAS = [
+        'journal_mode = WAL',
+        'synchronous = NORMAL',  # WAL stays consistent, only the last commits may be lost on power failure
+        'cache_size = -4096',  # KiB
+        'temp_store = MEMORY',
+    ]
+
+    # the type column of KIKKA_MEMORY
+    TYPE_LEGACY = 0
+    TYPE_TEXT = 1
+    TYPE_BOOL = 2
+    TYPE_INT = 3
+    TYPE_FLOAT = 4
+    TYPE_OBJECT = 5  # pickled BLOB
+
+    # INTEGER range of sqlite, larger ints are pickled
+    INT_MIN = -2 ** 63
+    INT_MAX = 2 ** 63 - 1
 
     def __init__(self):
         self._file_path = None
         self._sql_worker = None
 
+        # write-through copy of the memory: table name -> {(key, soul): value}
+        self._tables = {}
+        self._hits = 0
+        self._misses = 0
+        self._writes = 0
+
+        # write-behind: (table name, key, soul) -> (type, value) as saved, written together by flush()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._flush_timer = None
+        self._coalesced = 0
+        self._flushes = 0
+
     def awake(self, filename):
         self._file_path = filename
-        self._sql_worker = Sqlite3Worker(filename)
+        self._sql_worker = Sqlite3Worker(filename, pragmas=self.PRAGMAS)
+        self._migrate()
+        self._load_tables()
         logging.info("linked kikka memory")
 
     def close(self):
         if self._sql_worker:
-            self._sql_worker.close()
-            self._sql_worker = None
+            self.flush()
+            logging.info("kikka memory: %s", self.get_stats())
+            # a flush() of the timer sees no worker from now on, rather than queue after the worker ends
+            with self._pending_lock:
+                sql_worker, self._sql_worker = self._sql_worker, None
+            sql_worker.close()
+
+    @staticmethod
+    def get_table_name(table_name):
+        return str(table_name).upper()
+
+    def _get_legacy_table_names(self):
+        result = self._sql_worker.execute(
+            r"select name from sqlite_master where type='table' and name like 'T\_%' escape '\'")
+        return [row[0] for row in result] if not isinstance(result, str) else []
+
+    def _migrate(self):
+        result = self._sql_worker.execute("pragma user_version")
+        version = result[0][0] if not isinstance(result, str) else self.VERSION
+        if version >= self.VERSION:
+            return
+
+        # all the memory is kept in one table, the name column replaces the T_<name> tables of old versions
+        queries = [("create table if not exists %s(name text not null, key text not null, soul integer not null, "
+                    "type integer not null default 0, value, primary key (name, key, soul)) without rowid"
+                    % self.TABLE, None)]
+        for table in self._get_legacy_table_names():
+            # version 0 saved text values only, they are typed when read, see LegacyText
+            columns = [row[1] for row in self._sql_worker.execute("pragma table_info(%s)" % table)]
+            value_type = 'type' if 'type' in columns else str(self.TYPE_LEGACY)
+            queries.append(("insert or replace into %s(name, key, soul, type, value) "
+                            "select ?, key, soul, %s, value from %s" % (self.TABLE, value_type, table),
+                            (table[2:],)))
+            queries.append(("drop table %s" % table, None))
+        queries.append(("pragma user_version = %d" % self.VERSION, None))
+        if self._sql_worker.transaction(queries):
+            logging.info("kikka memory: migrate from version %d to %d", version, self.VERSION)
+        else:
+            logging.error("kikka memory: migrate from version %d fail", version)
+
+    def _load_tables(self):
+        """read the whole memory into the cache with one query"""
+        self._tables = {}
+        result = self._sql_worker.execute("select name, key, soul, type, value from %s" % self.TABLE)
+        if isinstance(result, str):
+            logging.warning("load kikka memory fail")
+            return
+
+        for name, key, soul, value_type, value in result:
+            try:
+                self._tables.setdefault(name, {})[(key, soul)] = self._decode(value_type, value)
+            except Exception:
+                logging.warning('load memory fail: key[%s]' % key)
+        logging.info("load kikka memory: %d tables %d rows", len(self._tables), len(result))
+
+    def _encode(self, value):
+        """(type, value) as saved in sqlite"""
+        if isinstance(value, bool):
+            return self.TYPE_BOOL, int(value)
+        elif isinstance(value, int) and self.INT_MIN <= value <= self.INT_MAX:
+            return self.TYPE_INT, value
+        elif isinstance(value, float):
+            return self.TYPE_FLOAT, value
+        elif isinstance(value, str):
+            return self.TYPE_TEXT, value
+        else:
+            return self.TYPE_OBJECT, pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def _decode(self, value_type, value):
+        if value_type == self.TYPE_TEXT:
+            return str(value)
+        elif value_type == self.TYPE_BOOL:
+            return bool(value)
+        elif value_type == self.TYPE_INT:
+            return int(value)
+        elif value_type == self.TYPE_FLOAT:
+            return float(value)
+        elif value_type == self.TYPE_OBJECT:
+            return pickle.loads(value)
+        else:
+            return LegacyText(value)
+
+    @staticmethod
+    def _convert_legacy(value, default):
+        if isinstance(default, str) is True:
+            return str(value)
+        elif isinstance(default, bool) is True:
+            return value == 'True'
+        elif isinstance(default, int) is True:
+            return int(value)
+        elif isinstance(default, float) is True:
+            return float(value)
+        elif isinstance(default, (list, dict)) is True:
+            return json.loads(value)
+        else:
+            return default
 
     def create_table(self, table_name):
-        try:
-            name = str('T_' + table_name).upper()
-            sql = "create table if not exists %s" \
-                  "(key text not null, soul integer not null, value text, primary key (key, soul))" % name
-            self._sql_worker.execute(sql)
-        except ValueError:
-            logging.warning('read table memory fail: key[%s]' % table_name)
+        """tables only group keys in KIKKA_MEMORY, nothing is created in the database"""
+        self._tables.setdefault(self.get_table_name(table_name), {})
 
     def read(self, table_name, key, default='', soul_id=0):
         logging.debug("kikka memory read %s" % key)
         try:
-            name = str('T_' + table_name).upper()
-            sql = "select value from %s where key=? and soul=?" % name
-
-            result = self._sql_worker.execute(sql, (key, soul_id))
-            if len(result) != 0:
-                value = result[0][0]
-            else:
+            name = self.get_table_name(table_name)
+            table = self._tables.get(name, None)
+            if table is None or (key, soul_id) not in table:
+                self._misses += 1
                 return default
 
-            if isinstance(default, str) is True:
-                return str(value)
-            elif isinstance(default, bool) is True:
-                return value == 'True'
-            elif isinstance(default, int) is True:
-                return int(value)
-            elif isinstance(default, float) is True:
-                return float(value)
-            elif isinstance(default, list) is True:
-                return json.loads(value)
-            elif isinstance(default, dict) is True:
-                return json.loads(value)
-            else:
-                return default
+            self._hits += 1
+            value = table[(key, soul_id)]
+            if isinstance(value, LegacyText):
+                # saved by an old version, keep it typed from now on
+                value = self._convert_legacy(value, default)
+                if isinstance(default, (str, bool, int, float, list, dict)):
+                    self.write(table_name, key, value, soul_id)
+                return value
+
+            # the cache keeps its own copy of lists and dicts
+            return copy.deepcopy(value) if isinstance(value, (list, dict)) else value
         except ValueError:
             logging.warning('read memory fail: key[%s]' % key)
             return default
@@ -68,25 +195,84 @@ class KikkaMemory(Singleton):
     def write(self, table_name, key, value, soul_id=0):
         logging.debug("kikka memory write %s" % key)
         try:
-            name = str('T_' + table_name).upper()
-            sql = "insert or replace into %s(key, soul, value) values(?, ?, ?)" % name
-
-            if isinstance(value, dict) is True:
-                for k in value.keys():
-                    if isinstance(k, (bool, int, float)) is False:
-                        continue
-                    logging.warning("when write dict to memory, "
-                                    "the key of bool, int or float will be converted to string")
-                    break
-
-            value = str(value) if isinstance(value, (list, dict)) is False else json.dumps(value)
-            self._sql_worker.execute(sql, (key, soul_id, value))
+            name = self.get_table_name(table_name)
+            self._writes += 1
+            table = self._tables.setdefault(name, {})
+            old = table.get((key, soul_id), None)
+            if type(old) is type(value) and old == value:
+                self._coalesced += 1
+                return
+
+            value_type, data = self._encode(value)
+            table[(key, soul_id)] = pickle.loads(data) if value_type == self.TYPE_OBJECT else value
+
+            with self._pending_lock:
+                if (name, key, soul_id) in self._pending:
+                    self._coalesced += 1
+                self._pending[(name, key, soul_id)] = (value_type, data)
+                if self._flush_timer is None:
+                    self._flush_timer = threading.Timer(kikka.const.MemoryWriteDelay / 1000, self.flush)
+                    self._flush_timer.daemon = True
+                    self._flush_timer.start()
         except Exception:
             logging.warning('write memory fail: key[%s]' % key)
 
+    def flush(self):
+        """save the pending writes in one transaction"""
+        with self._pending_lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if len(self._pending) == 0 or self._sql_worker is None:
+                return
+
+            # the same sql for every row, sqlite3 prepares it once and keeps it in the statement cache
+            sql = "insert or replace into %s(name, key, soul, type, value) values(?, ?, ?, ?, ?)" % self.TABLE
+            queries = [(sql, (name, key, soul_id, value_type, data))
+                       for (name, key, soul_id), (value_type, data) in self._pending.items()]
+            rows = self._pending
+            self._pending = {}
+            self._flushes += 1
+            # queued while holding the lock, close() takes the worker away under the same lock
+            future = self._sql_worker.transaction(queries, wait=False)
+
+        if future is False:
+            self._restore_pending(rows)
+        else:
+            future.add_done_callback(lambda f: self._on_flushed(f, rows))
+
+    def _on_flushed(self, future, rows):
+        """run by the worker thread once the transaction of flush() is done"""
+        if future.exception() is None and future.result():
+            return
+        self._restore_pending(rows)
+
+    def _restore_pending(self, rows):
+        """keep the rows of a failed flush for the next one, unless they were written again since"""
+        with self._pending_lock:
+            for row, value in rows.items():
+                self._pending.setdefault(row, value)
+        logging.warning("kikka memory: save %d rows fail, keep them for the next flush: %s",
+                        len(rows), sorted(rows.keys())[:10])
+
     def execute(self, query, values=None):
+        """run sql directly, the cache and the writes waiting for flush() do not see it"""
         return self._sql_worker.execute(query, values)
 
+    def get_stats(self):
+        return {
+            'tables': len(self._tables),
+            'rows': sum(len(table) for table in self._tables.values()),
+            'hits': self._hits,
+            'misses': self._misses,
+            'writes': self._writes,
+            'coalesced': self._coalesced,
+            'flushes': self._flushes,
+            'pending': len(self._pending),
+            'queue': self._sql_worker.queue_size if self._sql_worker is not None else 0,
+            'sql': self._sql_worker.get_stats() if self._sql_worker is not None else {},
+        }
+
 
 # ###########################################################################################################
 # Copyright (c) 2014 Palantir Technologies
@@ -124,123 +310,173 @@ class Sqlite3Worker(threading.Thread):
             "CREATE TABLE tester (timestamp DATETIME, uuid TEXT)")
         sql_worker.execute(
             "INSERT into tester values (?, ?)", ("2010-01-01 13:00:00", "bow"))
-        sql_worker.execute(
-            "INSERT into tester values (?, ?)", ("2011-02-02 14:14:14", "dog"))
+        sql_worker.execute_many(
+            "INSERT into tester values (?, ?)", [("2011-02-02 14:14:14", "dog"), ("2012-03-03 15:15:15", "cat")])
+        sql_worker.transaction([
+            ("DELETE from tester where uuid=?", ("bow",)),
+            ("INSERT into tester values (?, ?)", ("2013-04-04 16:16:16", "bow"))])
         sql_worker.execute("SELECT * from tester")
         sql_worker.close()
     """
-    def __init__(self, file_name, max_queue_size=100):
+    EXECUTE = 0
+    EXECUTE_MANY = 1
+    TRANSACTION = 2
+
+    def __init__(self, file_name, max_queue_size=100, pragmas=None, cached_statements=256):
         """Automatically starts the thread.
         Args:
             file_name: The name of the file.
-            max_queue_size: The max queries that will be queued.
+            max_queue_size: The max queries committed together, the queue itself is unbounded
+                so that writes never block the caller.
+            pragmas: PRAGMA statements run once the database is opened, like 'journal_mode = WAL'.
+            cached_statements: Prepared statements kept by the connection, reused for the same sql.
         """
         threading.Thread.__init__(self)
         self.daemon = True
-        self.sqlite3_conn = sqlite3.connect(file_name, check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES)
+        self.sqlite3_conn = sqlite3.connect(file_name, check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES,
+                                            cached_statements=cached_statements)
         self.sqlite3_cursor = self.sqlite3_conn.cursor()
-        self.sql_queue = queue.Queue(maxsize=max_queue_size)
-        self.results = {}
+        for pragma in pragmas or []:
+            try:
+                self.sqlite3_cursor.execute("pragma " + pragma)
+            except sqlite3.Error as err:
+                logging.warning("pragma %s fail: %s", pragma, err)
+        self.sql_queue = queue.Queue()
         self.max_queue_size = max_queue_size
         self.exit_set = False
-        # Token that is put into queue when close() is called.
-        self.exit_token = str(uuid.uuid4())
+
+        # queue wait and execution time of the queries, in ms
+        self._stats_lock = threading.Lock()
+        self._query_count = 0
+        self._wait_time = 0.0
+        self._wait_time_max = 0.0
+        self._execute_time = 0.0
+        self._execute_time_max = 0.0
         self.start()
-        self.thread_running = True
 
     def run(self):
         """Thread loop.
-        This is an infinite loop.  The iter method calls self.sql_queue.get()
-        which blocks if there are not values in the queue.  As soon as values
-        are placed into the queue the process will continue.
+        The iter method calls self.sql_queue.get() which blocks if there are not
+        values in the queue, close() puts None to end the loop once the queries
+        before it are done.
         If many executes happen at once it will churn through them all before
         calling commit() to speed things up by reducing the number of times
         commit is called.
         """
         logging.debug("run: Thread started")
-        execute_count = 0
-        for token, query, values in iter(self.sql_queue.get, None):
+        self._execute_count = 0
+        for future, kind, query, values, queue_time in iter(self.sql_queue.get, None):
             logging.debug("sql_queue: %s", self.sql_queue.qsize())
-            if token != self.exit_token:
-                logging.debug("run: %s", query)
-                self.run_query(token, query, values)
-                execute_count += 1
-                # Let the executes build up a little before committing to disk
-                # to speed things up.
-                if self.sql_queue.empty() or execute_count == self.max_queue_size:
-                    logging.debug("run: commit")
-                    self.sqlite3_conn.commit()
-                    execute_count = 0
-            pass  # exit if
-
-            # Only exit if the queue is empty. Otherwise keep getting
-            # through the queue until it's empty.
-            if self.exit_set and self.sql_queue.empty():
-                self.sqlite3_conn.commit()
-                self.sqlite3_conn.close()
-                self.thread_running = False
-                return
-        pass
+            start_time = time.perf_counter()
+            try:
+                result = self.run_item(kind, query, values)
+            except Exception as err:
+                # keep the thread alive, the caller gets the error from its Future
+                logging.error("Query failed: %s: %s", query, err)
+                future.set_exception(err)
+                continue
+            finally:
+                self._record_time((start_time - queue_time) * 1000, (time.perf_counter() - start_time) * 1000)
+            future.set_result(result)
+
+        self.sqlite3_conn.commit()
+        self.sqlite3_conn.close()
 
-    def run_query(self, token, query, values):
+    def run_item(self, kind, query, values):
+        if kind == self.TRANSACTION:
+            self._execute_count = 0
+            return self.run_transaction(query)
+
+        logging.debug("run: %s", query)
+        result = self.run_query(kind, query, values)
+        self._execute_count += 1
+        # Let the executes build up a little before committing to disk
+        # to speed things up.
+        if self.sql_queue.empty() or self._execute_count == self.max_queue_size:
+            logging.debug("run: commit")
+            self.sqlite3_conn.commit()
+            self._execute_count = 0
+        return result
+
+    def run_query(self, kind, query, values):
         """Run a query.
         Args:
-            token: A uuid object of the query you want returned.
+            kind: EXECUTE or EXECUTE_MANY.
             query: A sql query with ? placeholders for values.
-            values: A tuple of values to replace "?" in query.
+            values: A tuple of values to replace "?" in query, a list of them for EXECUTE_MANY.
+        Returns:
+            The rows of a select query, the error message if it fails.
         """
-        if query.lower().strip().startswith("select"):
-            try:
-                self.sqlite3_cursor.execute(query, values)
-                self.results[token] = self.sqlite3_cursor.fetchall()
-            except sqlite3.Error as err:
-                # Put the error into the output queue since a response
-                # is required.
-                self.results[token] = ("Query returned error: %s: %s: %s" % (query, values, err))
-                logging.error("Query returned error: %s: %s: %s", query, values, err)
-            pass
-        else:
-            try:
+        try:
+            if kind == self.EXECUTE_MANY:
+                self.sqlite3_cursor.executemany(query, values)
+            else:
                 self.sqlite3_cursor.execute(query, values)
-            except sqlite3.Error as err:
-                logging.error(
-                    "Query returned error: %s: %s: %s", query, values, err)
-        pass
+            return self.sqlite3_cursor.fetchall() if self._has_result(query) else None
+        except (sqlite3.Error, ValueError, TypeError, OverflowError) as err:
+            logging.error("Query returned error: %s: %s: %s", query, values, err)
+            return "Query returned error: %s: %s: %s" % (query, values, err)
+
+    def run_transaction(self, queries):
+        """Run [(query, values)] as one transaction, nothing is written if any of them fails."""
+        try:
+            self.sqlite3_conn.commit()
+            for query, values in queries:
+                logging.debug("run: %s", query)
+                self.sqlite3_cursor.execute(query, values or [])
+            self.sqlite3_conn.commit()
+            return True
+        except Exception as err:
+            self.sqlite3_conn.rollback()
+            logging.error("Transaction returned error: %s", err)
+            return False
 
     def close(self):
         """Close down the thread and close the sqlite3 database file."""
         self.exit_set = True
-        self.sql_queue.put((self.exit_token, "", ""), timeout=5)
-        # Sleep and check that the thread is done before returning.
-        while self.thread_running:
-            time.sleep(.01)  # Don't kill the CPU waiting.
+        self.sql_queue.put(None)
+        self.join()
 
     @property
     def queue_size(self):
         """Return the queue size."""
         return self.sql_queue.qsize()
 
-    def query_results(self, token):
-        """Get the query results for a specific token.
-        Args:
-            token: A uuid object of the query you want returned.
+    @staticmethod
+    def _has_result(query):
+        return query.lower().strip().startswith(("select", "pragma"))
+
+    def _record_time(self, wait_time, execute_time):
+        with self._stats_lock:
+            self._query_count += 1
+            self._wait_time += wait_time
+            self._wait_time_max = max(self._wait_time_max, wait_time)
+            self._execute_time += execute_time
+            self._execute_time_max = max(self._execute_time_max, execute_time)
+
+    def get_stats(self):
+        with self._stats_lock:
+            count = max(self._query_count, 1)
+            return {
+                'queries': self._query_count,
+                'wait_ms_mean': self._wait_time / count,
+                'wait_ms_max': self._wait_time_max,
+                'execute_ms_mean': self._execute_time / count,
+                'execute_ms_max': self._execute_time_max,
+            }
+
+    def submit(self, kind, query, values=None):
+        """Queue a query.
         Returns:
-            Return the results of the query when it's executed by the thread.
+            A Future completed by the worker thread with the result of the query,
+            None if the worker is closing.
         """
-        delay = .001
-        while True:
-            if token in self.results:
-                return_val = self.results[token]
-                del self.results[token]
-                return return_val
-            # Double back on the delay to a max of 8 seconds.  This prevents
-            # a long lived select statement from trashing the CPU with this
-            # infinite loop as it's waiting for the query results.
-            logging.debug("Sleeping: %s %s", delay, token)
-            time.sleep(delay)
-            if delay < 8:
-                delay += delay
-        pass
+        if self.exit_set:
+            logging.debug("Exit set, not running: %s", query)
+            return None
+        future = Future()
+        self.sql_queue.put((future, kind, query, values or [], time.perf_counter()))
+        return future
 
     def execute(self, query, values=None):
         """Execute a query.
@@ -248,21 +484,27 @@ class Sqlite3Worker(threading.Thread):
             query: The sql string using ? for placeholders of dynamic values.
             values: A tuple of values to be replaced into the ? of the query.
         Returns:
-            If it's a select query it will return the results of the query.
+            If it's a select or pragma query it will wait for and return the results of the query.
         """
-        if self.exit_set:
-            logging.debug("Exit set, not running: %s", query)
-            return "Exit Called"
         logging.debug("execute: %s", query)
-        values = values or []
-        # A token to track this query with.
-        token = str(uuid.uuid4())
-        # If it's a select we queue it up with a token to mark the results
-        # into the output queue so we know what results are ours.
-        if query.lower().strip().startswith("select"):
-            self.sql_queue.put((token, query, values), timeout=5)
-            return self.query_results(token)
-        else:
-            self.sql_queue.put((token, query, values), timeout=5)
+        future = self.submit(self.EXECUTE, query, values)
+        if future is None:
+            return "Exit Called"
+        if self._has_result(query):
+            return future.result()
 
-    pass
+    def execute_many(self, query, values_list):
+        """Execute a query once for each values in values_list, without waiting."""
+        logging.debug("execute_many: %s", query)
+        self.submit(self.EXECUTE_MANY, query, list(values_list))
+
+    def transaction(self, queries, wait=True):
+        """Execute [(query, values)] in one transaction.
+        Returns:
+            True if all the queries are committed, False if it was rolled back.
+            The Future of the result if wait is False.
+        """
+        future = self.submit(self.TRANSACTION, list(queries))
+        if future is None:
+            return False
+        return future.result() if wait else future
@@ -97,6 +97,8 @@ class KikkaMenu(Singleton):
             act.setCheckable(True)
             act.setChecked(kikka.ghost.isDebug is True)
 
+            menu.add_menu_item("Dump tick report", lambda: kikka.core.dump_update_time_report())
+
             menu.add_sub_menu(Menu(menu, ghost.id, "TestSurface"))
             menu.add_sub_menu(KikkaMenu.create_test_menu(menu))
 
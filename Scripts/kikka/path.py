@@ -10,4 +10,6 @@ GHOSTS = os.path.join(ROOT, "Ghosts")
 RESOURCES = os.path.join(ROOT, "Resources")
 SHELL = os.path.join(RESOURCES, "Shell")
 BALLOON = os.path.join(RESOURCES, "Balloon")
-IMAGE = os.path.join(RESOURCES, "Image")
\ No newline at end of file
+IMAGE = os.path.join(RESOURCES, "Image")
+
+CACHE = os.path.join(ROOT, "Cache")
\ No newline at end of file
@@ -0,0 +1,45 @@
+import os
+import sys
+import atexit
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+SHELL_CORPUS = os.path.join(ROOT, 'Ghosts', 'kikka', 'Resource', 'Shell')
+BALLOON_CORPUS = os.path.join(ROOT, 'Ghosts', 'kikka', 'Resource', 'Balloon')
+
+_memory_dir = None
+# the QApplication must outlive every widget, a caller dropping the return value would destroy it
+_app = None
+
+
+def setup():
+    """Start an offscreen QApplication and import kikka the same way Main.py does"""
+    global _memory_dir, _app
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+    # importing kikka opens the memory, keep it away from the real Kikka.memory and the cwd
+    if 'KIKKA_MEMORY' not in os.environ:
+        _memory_dir = tempfile.TemporaryDirectory(prefix='kikka_bench_')
+        os.environ['KIKKA_MEMORY'] = os.path.join(_memory_dir.name, 'Kikka.memory')
+        atexit.register(_remove_memory)
+
+    if ROOT in sys.path:
+        sys.path.remove(ROOT)
+    sys.path.insert(0, ROOT)
+    for dir_ in ["Scripts", "Ghosts", "Resources"]:
+        p = os.path.join(ROOT, dir_)
+        if p not in sys.path:
+            sys.path.append(p)
+
+    from PyQt5.QtWidgets import QApplication
+    _app = QApplication.instance() or QApplication(sys.argv)
+
+    import kikka
+    return _app
+
+
+def _remove_memory():
+    kikka = sys.modules.get('kikka', None)
+    if kikka is not None:
+        kikka.memory.close()
+    _memory_dir.cleanup()
@@ -0,0 +1,129 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+import bench_env
+
+
+def rate(count, seconds):
+    return count / seconds if seconds > 0 else None
+
+
+def flush(memory):
+    # older memories write through the worker directly and have no flush()
+    if hasattr(memory, 'flush'):
+        memory.flush()
+
+
+def populate(memory, tables, keys):
+    for t in range(tables):
+        table = 'ghost_bench%d' % t
+        memory.create_table(table)
+        for k in range(keys):
+            memory.write(table, 'key%d' % k, [k, k * 2, 'value'], k % 2)
+            memory.write(table, 'flag%d' % k, k % 3 == 0, k % 2)
+
+
+def bench_writes(memory, count):
+    memory.create_table('ghost_write')
+    start = time.perf_counter()
+    for i in range(count):
+        memory.write('ghost_write', 'key%d' % i, i * 1.5, i % 2)
+    queued = time.perf_counter() - start
+    flush(memory)
+    return queued
+
+
+def bench_burst(memory, count):
+    """a dragged window saves the same key over and over"""
+    memory.create_table('ghost_burst')
+    start = time.perf_counter()
+    for i in range(count):
+        memory.write('ghost_burst', 'ShellRect', [i, i, 300, 400])
+    return time.perf_counter() - start
+
+
+def bench_reads(memory, tables, keys, count):
+    rnd = random.Random(1)
+    queries = []
+    for _ in range(count):
+        k = rnd.randrange(keys)
+        queries.append(('ghost_bench%d' % rnd.randrange(tables), k))
+
+    start = time.perf_counter()
+    for table, k in queries:
+        memory.read(table, 'key%d' % k, [], k % 2)
+        memory.read(table, 'flag%d' % k, False, k % 2)
+    return time.perf_counter() - start
+
+
+def run(memory, path, args):
+    result = {}
+
+    memory.awake(path)
+    start = time.perf_counter()
+    populate(memory, args.tables, args.keys)
+    flush(memory)
+    memory.close()
+    result['populate_seconds'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    memory.awake(path)
+    for t in range(args.tables):
+        memory.create_table('ghost_bench%d' % t)
+    result['open_ms'] = (time.perf_counter() - start) * 1000
+
+    seconds = bench_reads(memory, args.tables, args.keys, args.count)
+    result['reads_per_second'] = rate(args.count * 2, seconds)
+
+    start = time.perf_counter()
+    queued = bench_writes(memory, args.count)
+    result['writes_per_second'] = rate(args.count, queued)
+    memory.close()
+    # close() waits for the worker, so this includes committing to the file
+    result['durable_writes_per_second'] = rate(args.count, time.perf_counter() - start)
+
+    memory.awake(path)
+    seconds = bench_burst(memory, args.count)
+    result['burst_writes_per_second'] = rate(args.count, seconds)
+    if hasattr(memory, 'get_stats'):
+        result['stats'] = memory.get_stats()
+    memory.close()
+
+    result['file_bytes'] = sum(os.path.getsize(path + ext) for ext in ['', '-wal'] if os.path.exists(path + ext))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-t', '--tables', help='ghost tables', type=int, default=10)
+    parser.add_argument('-k', '--keys', help='keys per table', type=int, default=200)
+    parser.add_argument('-n', '--count', help='reads and writes per case', type=int, default=5000)
+    parser.add_argument('-o', '--output', help='write the json to a file', type=str, default='')
+    args = parser.parse_args()
+
+    bench_env.setup()
+    import kikka
+
+    memory = kikka.memory
+    with tempfile.TemporaryDirectory(prefix='kikka_memory_') as memory_dir:
+        try:
+            result = run(memory, os.path.join(memory_dir, 'Kikka.memory'), args)
+        finally:
+            # the worker keeps the file open, close it before the folder is removed
+            memory.close()
+
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            fp.write(text)
+    print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
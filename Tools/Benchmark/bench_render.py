@@ -0,0 +1,204 @@
+import sys
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+import subprocess
+
+import bench_env
+
+
+def get_peak_rss():
+    """bytes, None if it can not be read on this platform"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        pass
+
+    # windows
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset
+    except (ImportError, AttributeError):
+        return None
+
+
+def get_commit():
+    try:
+        out = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=bench_env.ROOT,
+                                      stderr=subprocess.DEVNULL)
+        return out.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Recorder:
+    """time each call of a case and trace its python allocations"""
+    def __init__(self):
+        self.results = {}
+
+    def measure(self, name, func, repeat, setup=None):
+        """setup runs untimed before each call"""
+        times = []
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        for _ in range(repeat):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            func()
+            times.append((time.perf_counter() - start) * 1000)
+        current, peak = tracemalloc.get_traced_memory()
+        self.add(name, times, current - before, peak - before)
+
+    def add(self, name, times, alloc=0, alloc_peak=0):
+        item = self.results.setdefault(name, {'times': [], 'alloc_bytes': 0, 'alloc_peak_bytes': 0})
+        item['times'] += times
+        item['alloc_bytes'] += alloc
+        item['alloc_peak_bytes'] = max(item['alloc_peak_bytes'], alloc_peak)
+
+    def report(self):
+        report = {}
+        for name, item in self.results.items():
+            times = sorted(item['times'])
+            if not times:
+                continue
+            mean = sum(times) / len(times)
+            report[name] = {
+                'count': len(times),
+                'ms_mean': mean,
+                'ms_p50': times[len(times) // 2],
+                'ms_p95': times[int(len(times) * 0.95)],
+                'ms_max': times[-1],
+                'fps': 1000 / mean if mean > 0 else None,
+                'alloc_bytes': item['alloc_bytes'],
+                'alloc_peak_bytes': item['alloc_peak_bytes'],
+            }
+        return report
+
+
+def get_used_surfaces(shell, soul_id):
+    """the surfaces a ghost shows for the soul: 0-9 for sakura, 10-19 for kero"""
+    surface_ids = sorted(shell.get_surface_name_list().keys())
+    used = [sid for sid in surface_ids if soul_id * 10 <= sid < soul_id * 10 + 10]
+    return used or surface_ids[:1]
+
+
+def bench_shells(recorder, ghost, shell_names, repeat, frames):
+    import kikka
+
+    for shell_name in shell_names:
+        ghost.set_shell(shell_name)
+        shell = ghost.get_current_shell()
+        for soul_id in range(ghost.get_soul_count()):
+            soul = ghost.get_soul(soul_id)
+            for surface_id in get_used_surfaces(shell, soul_id):
+                soul.set_surface(surface_id)
+                recorder.measure('soul.repaint', soul.repaint, repeat)
+                # cold composes the surface every time, warm is a hit in the base image cache
+                recorder.measure('soul.repaint_base_image cold', soul.repaint_base_image, repeat,
+                                 soul.clear_base_images)
+                recorder.measure('soul.repaint_base_image warm', soul.repaint_base_image, repeat)
+
+                # replay the animations on the virtual clock
+                for aid in list(soul.get_animation().keys()):
+                    if soul.get_animation()[aid].interval not in ['never', 'bind', 'talk', 'yen-e']:
+                        soul.animation_start(aid)
+                times = []
+                for _ in range(frames):
+                    step = max(kikka.core.get_timer_interval(), min(soul.get_next_update_time(), 1000))
+                    kikka.clock.advance(step)
+                    start = time.perf_counter()
+                    is_update = soul.on_update(step)
+                    if is_update:
+                        times.append((time.perf_counter() - start) * 1000)
+                recorder.add('soul.on_update frame', times)
+
+
+def bench_draw_image(recorder, ghost, repeat):
+    from PyQt5.QtGui import QImage
+    import kikka
+
+    images = ghost.get_shell_image()
+    names = sorted(images.keys())[:20]
+    dest = QImage(500, 500, QImage.Format_ARGB32_Premultiplied)
+    for draw_type in ['base', 'overlay', 'overlayfast', 'replace', 'interpolate', 'asis']:
+        def draw():
+            for name in names:
+                kikka.helper.draw_image(dest, images[name], 0, 0, draw_type)
+        recorder.measure('helper.draw_image %s x%d' % (draw_type, len(names)), draw, repeat)
+
+
+def bench_balloons(recorder, ghost, repeat):
+    from PyQt5.QtCore import QSize
+
+    for balloon_id in range(ghost.get_balloon_count()):
+        ghost.set_balloon(ghost.get_balloon(balloon_id).name)
+        for size in [QSize(200, 150), QSize(400, 300), QSize(800, 600)]:
+            recorder.measure('ghost.get_balloon_image %dx%d' % (size.width(), size.height()),
+                             lambda: ghost.get_balloon_image(size), repeat)
+
+
+def bench_menu(recorder, ghost, repeat):
+    menu = ghost.get_soul(0).get_menu()
+    menu.adjustSize()
+    recorder.measure('menu.paintEvent', lambda: menu.grab(), repeat)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-g', '--ghost', help='ghost index', type=int, default=0)
+    parser.add_argument('-s', '--shells', help='shell names, default the first --shell-count shells', nargs='*')
+    parser.add_argument('-n', '--shell-count', help='shells to replay', type=int, default=5)
+    parser.add_argument('-r', '--repeat', help='calls per case', type=int, default=20)
+    parser.add_argument('-f', '--frames', help='animation frames per surface', type=int, default=200)
+    parser.add_argument('-o', '--output', help='write the json to a file', type=str, default='')
+    args = parser.parse_args()
+
+    app = bench_env.setup()
+    import kikka
+    from PyQt5.QtCore import QT_VERSION_STR
+
+    tracemalloc.start()
+    kikka.clock.use_virtual_clock()
+    kikka.ghost.scan_ghost(kikka.path.GHOSTS)
+    gid = kikka.core.add_ghost(kikka.ghost.get_ghost(args.ghost))
+    ghost = kikka.core.get_ghost(gid)
+    ghost.show()
+
+    shell_count = min(args.shell_count, ghost.get_shell_count())
+    shell_names = args.shells or [ghost.get_shell(i).name for i in range(shell_count)]
+
+    recorder = Recorder()
+    start = time.perf_counter()
+    bench_shells(recorder, ghost, shell_names, args.repeat, args.frames)
+    bench_draw_image(recorder, ghost, args.repeat)
+    bench_balloons(recorder, ghost, args.repeat)
+    bench_menu(recorder, ghost, args.repeat)
+
+    result = {
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'qt': QT_VERSION_STR,
+        'platform': platform.platform(),
+        'ghost': ghost.name,
+        'shells': shell_names,
+        'seconds': time.perf_counter() - start,
+        'peak_rss_bytes': get_peak_rss(),
+        'py_alloc_peak_bytes': tracemalloc.get_traced_memory()[1],
+        'cases': recorder.report(),
+    }
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            fp.write(text)
+    print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,41 @@
+import sys
+import json
+import time
+import argparse
+import datetime
+
+import bench_env
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-g', '--ghost', help='ghost index', type=int, default=0)
+    parser.add_argument('-t', '--time', help='virtual hours to run', type=float, default=4.0)
+    parser.add_argument('-s', '--max-step', help='longest virtual step in ms', type=float, default=None)
+    parser.add_argument('-w', '--wall-start', help='virtual wall time to start at, like 2020-01-01T08:00',
+                        type=datetime.datetime.fromisoformat, default=None)
+    args = parser.parse_args()
+
+    # setup() keeps the soak run away from the real memory file
+    app = bench_env.setup()
+    from ghost.headless import HeadlessRunner
+
+    runner = HeadlessRunner(args.ghost, wall_start=args.wall_start)
+    runner.start()
+    start = time.perf_counter()
+    stats = runner.run(args.time * 3600, args.max_step)
+    stats['real_seconds'] = time.perf_counter() - start
+    print(json.dumps(stats, indent=2))
+
+    # every virtual minute needs a core run, or the minute events of the ghost were not exercised
+    if stats['run_minutes'] < stats['minutes']:
+        print("ERROR: core ran in %d of %d minutes" % (stats['run_minutes'], stats['minutes']))
+        return 1
+    if stats['minutes'] > 0 and stats['minute_events'] <= 0:
+        print("ERROR: the ghost handled no minute events")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
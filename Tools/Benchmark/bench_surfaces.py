@@ -0,0 +1,131 @@
+import os
+import re
+import sys
+import time
+import argparse
+
+import bench_env
+
+
+def legacy_match_line(line):
+    """SurfaceMatchLine.match_line before the rules were precompiled, kept as the baseline"""
+    from ghost.shell import SurfaceMatchLine
+
+    res = re.match(
+        r'^element(\d+),(base|overlay|overlayfast|replace|interpolate|asis|move|bind|add|reduce|insert),'
+        r'(\w+.png),(\d+),(\d+)$',
+        line)
+    if res is not None:
+        return SurfaceMatchLine.Elements, res.groups()
+
+    res = re.match(
+        r'^(?:animation)?(\d+).?interval,(sometimes|rarely|random,\d+|periodic,'
+        r'\d+[.][0-9]*|always|runonce|never|yen-e|talk,\d+|bind)$',
+        line)
+    if res is not None:
+        return SurfaceMatchLine.AnimationInterval, res.groups()
+
+    res = re.match(
+        r'^(\d+)pattern(\d+),(\-?\d+),(\d+),(insert|start|stop|alternativestart|alternativestop),'
+        r'(?:[\[\(]?((?:\d+[\.\,])*\d+)[\]\)]?)$',
+        line)
+    if res is not None:
+        return SurfaceMatchLine.AnimationPatternAlternative, res.groups()
+
+    res = re.match(
+        r'^(\d+)pattern(\d+),(\-?\d+),(\d+),'
+        r'(base|overlay|overlayfast|replace|interpolate|asis|move|bind|add|reduce),(\-?\d+),(\-?\d+)$',
+        line)
+    if res is not None:
+        return SurfaceMatchLine.AnimationPattern, res.groups()
+
+    res = re.match(
+        r'^animation(\d+).pattern(\d+),(base|overlay|overlayfast|replace|interpolate|asis|move|bind|add|reduce),'
+        r'(\-?\d+),(\d+),(\-?\d+),(\-?\d+)$',
+        line)
+    if res is not None:
+        return SurfaceMatchLine.AnimationPatternNew, res.groups()
+
+    res = re.match(r'^(\d+)option,exclusive$', line)
+    if res is not None:
+        return SurfaceMatchLine.AnimationOptionExclusive, res.groups()
+
+    res = re.match(r'^collision(\d+),(\d+),(\d+),(\d+),(\d+),(\w+)$', line)
+    if res is not None:
+        return SurfaceMatchLine.CollisionBoxes, res.groups()
+
+    for match_type, pattern in [
+        (SurfaceMatchLine.SurfaceCenterX, r'^point.centerx,(\d+)$'),
+        (SurfaceMatchLine.SurfaceCenterY, r'^point.centery,(\d+)$'),
+        (SurfaceMatchLine.KinokoCenterX, r'^point.kinoko.centerx,(\d+)$'),
+        (SurfaceMatchLine.KinokoCenterY, r'^point.kinoko.centery,(\d+)$'),
+        (SurfaceMatchLine.BasePosX, r'^point.base_pos.centerx,(\d+)$'),
+        (SurfaceMatchLine.BasePosY, r'^point.base_pos.centery,(\d+)$'),
+    ]:
+        res = re.match(pattern, line)
+        if res is not None:
+            return match_type, res.groups()
+
+    return SurfaceMatchLine.Unknown, None
+
+
+def collect_lines(shell_dir):
+    """the surface definition lines (inside braces) of every surfaces*.txt in the corpus"""
+    from ghost.shell import COMMENT_PREFIX
+
+    lines = []
+    for parent, dir_names, file_names in os.walk(shell_dir):
+        for file_name in file_names:
+            if not (file_name.startswith('surfaces') and file_name.endswith('.txt')):
+                continue
+            in_block = False
+            with open(os.path.join(parent, file_name), 'r', encoding='utf-8') as fp:
+                for line in fp:
+                    line = line.strip(' \r\n')
+                    if line == '' or line.startswith(COMMENT_PREFIX):
+                        continue
+                    if line == '{':
+                        in_block = True
+                    elif line == '}':
+                        in_block = False
+                    elif in_block and ',' in line:
+                        lines.append(line)
+    return lines
+
+
+def run(func, lines, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for line in lines:
+            func(line)
+        cost = time.perf_counter() - start
+        best = cost if best is None else min(best, cost)
+    return len(lines) / best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-p', '--path', help='shell dir', type=str, default=bench_env.SHELL_CORPUS)
+    parser.add_argument('-r', '--repeat', help='repeat times, the best one is reported', type=int, default=5)
+    args = parser.parse_args()
+
+    bench_env.setup()
+    from ghost.shell import SurfaceMatchLine
+
+    lines = collect_lines(args.path)
+    mismatch = [line for line in lines if legacy_match_line(line) != SurfaceMatchLine.match_line(line)]
+    for line in mismatch[:10]:
+        print("MISMATCH:", line)
+
+    before = run(legacy_match_line, lines, args.repeat)
+    after = run(SurfaceMatchLine.match_line, lines, args.repeat)
+    print("lines:    %d (%d mismatch)" % (len(lines), len(mismatch)))
+    print("before:   %.0f lines/sec" % before)
+    print("after:    %.0f lines/sec" % after)
+    print("speedup:  %.2fx" % (after / before))
+    return 1 if mismatch else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,6 @@
+py -3 bench_surfaces.py
+py -3 bench_soak.py
+py -3 bench_render.py -o render.json
+py -3 bench_memory.py -o memory.json
+
+pause
@@ -1,9 +1,16 @@
 import os
-import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 from PIL import Image
 
 
 class FormatShellImage:
+    def __init__(self, jobs=None, dry_run=False):
+        self.jobs = jobs if jobs is not None else os.cpu_count() or 1
+        self.dry_run = dry_run
+
     def do_work(self, shell_path):
         pngs = {}
         pnas = {}
@@ -18,54 +25,102 @@ class FormatShellImage:
                 elif ext == ".pna":
                     pnas[filename] = os.path.join(root, file)
 
-        count = 0
-        success = 0
-        error = 0
+        tasks = []
         for filename in pngs.keys():
             if filename == 'background' \
             or filename == 'foreground' \
             or filename == 'sidebar':
                 continue
+            tasks.append((pngs[filename], pnas.get(filename, None), self.dry_run))
 
-            count += 1
-            try:
-                if filename in pnas:
-                    self._mix_pna(pngs[filename], pnas[filename])
-                else:
-                    self._clear_alpha_color(pngs[filename])
-                print(os.path.basename(pngs[filename]))
-                success += 1
-            except:
-                print("ERROR in:", pngs[filename])
+        count = len(tasks)
+        success = 0
+        error = 0
+        changed_files = 0
+        changed_pixels = 0
+        for png_path, pixels, err in self._map(tasks):
+            if err is not None:
+                print("ERROR in:", png_path, err)
                 error += 1
+                continue
+
+            success += 1
+            if pixels > 0:
+                changed_files += 1
+                changed_pixels += pixels
+            if self.dry_run:
+                print("%s: %d pixels" % (os.path.basename(png_path), pixels))
+            else:
+                print(os.path.basename(png_path))
+
+        if self.dry_run:
+            print("Dry run: %d of %d files would change, %d pixels" % (changed_files, count, changed_pixels))
         print("Finish: success %d, error %d" % (success, error))
 
-    def _mix_pna(self, png_path, pna_path):
-        img1 = Image.open(png_path)
-        img2 = Image.open(pna_path)
-        img1 = img1.convert('RGBA')
-        img2 = img2.convert('L')
-        img1.putalpha(img2)
-        img1.save(png_path)
+    def _map(self, tasks):
+        if self.jobs <= 1 or len(tasks) <= 1:
+            return map(FormatShellImage._format, tasks)
+
+        # results come back in the order of the files, the pool is shut down after the last one
+        def run():
+            with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+                yield from executor.map(FormatShellImage._format, tasks, chunksize=4)
+        return run()
+
+    @staticmethod
+    def _format(task):
+        """(png_path, changed pixels, error) of one image, run in the worker processes"""
+        png_path, pna_path, dry_run = task
+        try:
+            if pna_path is not None:
+                pixels = FormatShellImage._mix_pna(png_path, pna_path, dry_run)
+            else:
+                pixels = FormatShellImage._clear_alpha_color(png_path, dry_run)
+            return png_path, pixels, None
+        except Exception as e:
+            return png_path, 0, e
+
+    @staticmethod
+    def _mix_pna(png_path, pna_path, dry_run=False):
+        with Image.open(png_path) as img1, Image.open(pna_path) as img2:
+            pixels = np.array(img1.convert('RGBA'))
+            alpha = np.asarray(img2.convert('L'))
+        if alpha.shape != pixels.shape[:2]:
+            raise ValueError("pna size %s does not match png size %s" % (alpha.shape[::-1], pixels.shape[1::-1]))
+
+        changed = int(np.count_nonzero(pixels[..., 3] != alpha))
+        if dry_run:
+            return changed
+
+        pixels[..., 3] = alpha
+        Image.fromarray(pixels, 'RGBA').save(png_path)
         os.remove(pna_path)
+        return changed
 
-    def _clear_alpha_color(self, png_path):
-        img1 = Image.open(png_path)
-        img1 = img1.convert('RGBA')
+    @staticmethod
+    def _clear_alpha_color(png_path, dry_run=False):
+        with Image.open(png_path) as img1:
+            pixels = np.array(img1.convert('RGBA'))
 
-        color = img1.getpixel((0, 0))
+        color = pixels[0, 0]
         if color[3] == 0:
-            return
+            return 0
 
-        color2 = (color[0], color[1], color[2], 0)
-        pixels = img1.load()
-        for i in range(img1.size[0]):
-            for j in range(img1.size[1]):
-                    if pixels[i,j] == color:
-                        pixels[i,j] = color2
-        img1.save(png_path)
+        mask = np.all(pixels == color, axis=-1)
+        changed = int(np.count_nonzero(mask))
+        if dry_run:
+            return changed
+
+        pixels[mask, 3] = 0
+        Image.fromarray(pixels, 'RGBA').save(png_path)
+        return changed
 
 
 if __name__ == '__main__':
-    work_dir = sys.argv[1]
-    FormatShellImage().do_work(work_dir)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', help='shell path', type=str)
+    parser.add_argument('-j', '--jobs', help='worker processes, default the cpu count', type=int, default=None)
+    parser.add_argument('-n', '--dry-run', help='only report the files and pixels that would change', action="store_true")
+    args = parser.parse_args()
+
+    FormatShellImage(args.jobs, args.dry_run).do_work(args.path)
@@ -1,6 +1,6 @@
 set shell_path=%1
 if "%shell_path%"=="" set /p shell_path=shell path:
 
-py -3 FormatShellImage.py %shell_path%
+py -3 FormatShellImage.py %shell_path% %2 %3 %4
 
 pause
@@ -6,9 +6,20 @@ import zipfile
 import argparse
 
 DESCRIPT_FILE = "descript.json"
+IMAGE_FORMATS = [".bmp", ".png", ".jpg", ".jpeg", ".gif"]
 
 
 class GhostPack:
+    def __init__(self, store_images=False):
+        # images are compressed already, stored members can be read from the mapped zip without a copy
+        self.store_images = store_images
+
+    def _write(self, f, filename, arcname):
+        if self.store_images and os.path.splitext(filename)[1].lower() in IMAGE_FORMATS:
+            f.write(filename, arcname, zipfile.ZIP_STORED)
+        else:
+            f.write(filename, arcname)
+
     def pack(self, ghost_path, output_path, as_zip=True):
         self.ghost_path = ghost_path
         self.ghost_data = json.load(open(os.path.join(self.ghost_path, DESCRIPT_FILE), "r"))
@@ -46,7 +57,7 @@ class GhostPack:
             for root, dirs, files in os.walk(self.temp_path):
                 for file in files:
                     dstPath = os.path.join(self.ghost_name, os.path.relpath(root, self.temp_path), file)
-                    f.write(os.path.join(root, file), dstPath)
+                    self._write(f, os.path.join(root, file), dstPath)
             f.close()
         else:
             shutil.copytree(self.temp_path, os.path.join(output_path, self.ghost_name))
@@ -93,7 +104,7 @@ class GhostPack:
         for root, dirs, files in os.walk(target_dir):
             for file in files:
                 dstPath = os.path.join(os.path.relpath(root, root_path), file)
-                f.write(os.path.join(root, file), dstPath)
+                self._write(f, os.path.join(root, file), dstPath)
         f.close()
 
     def _walk_pack(self, walk_path, output_path):
@@ -123,6 +134,7 @@ if __name__ == "__main__":
     parser.add_argument('-p', '--path', help='ghost path', type=str, required=True)
     parser.add_argument('-o', '--output', help='output path', type=str, default='')
     parser.add_argument('-z', '--zip', help='output zip', action="store_true")
+    parser.add_argument('-s', '--store-images', help='store images without compression', action="store_true")
 
     args = parser.parse_args()
     ghost_path = args.path
@@ -132,4 +144,4 @@ if __name__ == "__main__":
     if output_path == "":
         output_path = ghost_path
 
-    GhostPack().pack(ghost_path, output_path, as_zip)
+    GhostPack(args.store_images).pack(ghost_path, output_path, as_zip)